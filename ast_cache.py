@@ -0,0 +1,120 @@
+import hashlib
+import marshal
+import os
+import sys
+import zlib
+
+from node import Node
+
+# anything that changes what a parse produces, or how it is written to disk, invalidates the cache
+grammar_files = ["tokenizer.py", "tokenizer_definition_util.py", "tokenizer_definitions.py",
+                 "compiler.py", "compiler_definitions.py", "node.py", "ast_cache.py"]
+
+def grammar_version():
+    digest = hashlib.sha256(f"{sys.version_info[:2]} {marshal.version}".encode())
+    root = os.path.dirname(os.path.abspath(__file__))
+    for name in grammar_files:
+        with open(os.path.join(root, name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def default_cache_directory():
+    if "PLUM_CACHE_DIR" in os.environ:
+        return os.environ["PLUM_CACHE_DIR"]
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "plum")
+
+# nodes are written as dicts, the AST never holds a dict of its own
+def encode(value):
+    if isinstance(value, Node):
+        return {key: encode(v) for key, v in value.__dict__.items()}
+    elif isinstance(value, list):
+        return [encode(v) for v in value]
+    elif isinstance(value, tuple):
+        return tuple(encode(v) for v in value)
+    else:
+        return value
+
+def decode(value):
+    if isinstance(value, dict):
+        return Node(value["type"], **{key: decode(v) for key, v in value.items() if key != "type"})
+    elif isinstance(value, list):
+        return [decode(v) for v in value]
+    elif isinstance(value, tuple):
+        return tuple(decode(v) for v in value)
+    else:
+        return value
+
+class ASTCache:
+    def __init__(self, directory=None, max_size=64 * 1024 * 1024):
+        self.directory = directory or default_cache_directory()
+        self.max_size = max_size
+        self.version = grammar_version()
+
+    def path(self, code):
+        key = hashlib.sha256(self.version.encode() + code.encode()).hexdigest()
+        return os.path.join(self.directory, key + ".plumc")
+
+    def load(self, code):
+        path = self.path(code)
+        try:
+            with open(path, "rb") as f:
+                nodes = decode(marshal.loads(zlib.decompress(f.read())))
+            # the modification time doubles as the last use for eviction
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except (EOFError, ValueError, TypeError, KeyError, OSError, zlib.error):
+            self.remove(path)
+            return None
+        return nodes
+
+    def store(self, code, nodes):
+        path = self.path(code)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(temp_path, "wb") as f:
+                # field names repeat in every node, even the fastest zlib level shrinks these a lot
+                f.write(zlib.compress(marshal.dumps(encode(nodes)), 1))
+            os.replace(temp_path, path)
+        except OSError:
+            # the cache is only an optimisation, never fail a run because of it
+            self.remove(temp_path)
+            return
+        self.evict()
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def entries(self):
+        # none when the directory can't be read, like a failed store, that never fails a run
+        entries = []
+        try:
+            with os.scandir(self.directory) as scan:
+                for entry in scan:
+                    if entry.name.endswith(".plumc"):
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError:
+            pass
+        return entries
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            self.remove(path)
+            total -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            self.remove(path)
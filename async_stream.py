@@ -0,0 +1,54 @@
+import asyncio
+import threading
+
+from pipe_stream import PipeStream
+
+# With --async an event loop runs on a thread of its own while the script runs on the main thread as it
+# always does, handing the loop anything that has to be awaited and waiting for it there. Async sources
+# are streams whose values come from an async iterator, and maps await what their function returns when
+# it's awaitable, a number of them at a time (see create_async_mapping).
+
+loop = None
+# awaitables a map has in flight at once
+concurrency = 16
+
+def start_loop():
+    global loop
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+async def run_awaitable(awaitable):
+    return await awaitable
+
+def submit(awaitable):
+    # a concurrent future for awaitable, run on the loop
+    if loop is None:
+        raise Exception("awaiting needs an event loop, run the script with --async")
+    return asyncio.run_coroutine_threadsafe(run_awaitable(awaitable), loop)
+
+def wait(awaitable):
+    return submit(awaitable).result()
+
+async def next_values(iterator, size):
+    # up to size values from an async iterator, fewer once it has ended
+    values = []
+    try:
+        while len(values) < size:
+            values.append(await iterator.__anext__())
+    except StopAsyncIteration:
+        pass
+    return values
+
+def read_async(upstream, this):
+    values = wait(next_values(upstream, 1))
+    if not values:
+        raise StopIteration
+    return values[0]
+
+read_async.batch = lambda upstream, this, size: wait(next_values(upstream, size))
+
+class AsyncPipeStream(PipeStream):
+    # a stream of the values of an async iterator, a batch is read in a single trip to the loop
+    def __init__(self, source, close=None, stream_converter=None):
+        super().__init__(source, read_async, close=close, stream_converter=stream_converter)
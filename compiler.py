@@ -1,37 +1,111 @@
 
 from token_parser import TokenParser, TokenParserError
 
+class PackratCache:
+    def __init__(self, max_entries=100000):
+        self.entries = {}
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        if len(self.entries) >= self.max_entries:
+            # drop the oldest entry, it belongs to the earliest (least likely to be revisited) position
+            del self.entries[next(iter(self.entries))]
+        self.entries[key] = entry
+
+    def clear(self):
+        self.entries.clear()
+
 class Compiler:
-    def __init__(self, stream=None, definitions=None, post_definitions=None):
+    def __init__(self, stream=None, definitions=None, post_definitions=None, packrat=False, max_cache_entries=100000,
+                 dispatch=None, post_dispatch=None):
         self.stream = stream
         self.definitions = definitions or []
         self.post_definitions = post_definitions or []
+        self.packrat = packrat
+        self.max_cache_entries = max_cache_entries
+        self.cache = PackratCache(max_cache_entries) if packrat else None
+        # token type -> definitions which may start with it, built lazily and shared between copies
+        self.dispatch = dispatch if dispatch is not None else {}
+        self.post_dispatch = post_dispatch if post_dispatch is not None else {}
 
-    def copy(self, stream):
-        return Compiler(stream, definitions=self.definitions, post_definitions=self.post_definitions)
+    def copy(self, stream, packrat=None):
+        if packrat is None:
+            packrat = self.packrat
+        return Compiler(stream, definitions=self.definitions, post_definitions=self.post_definitions,
+                        packrat=packrat, max_cache_entries=self.max_cache_entries,
+                        dispatch=self.dispatch, post_dispatch=self.post_dispatch)
 
-    def define(self, defn):
+    def define(self, defn=None, starts_with=None):
+        if defn is None:
+            return lambda defn: self.define(defn, starts_with=starts_with)
+        if starts_with is not None:
+            defn.starts_with = frozenset(starts_with)
         self.definitions.append(defn)
+        self.dispatch.clear()
+        return defn
 
-    def define_post(self, defn):
+    def define_post(self, defn=None, starts_with=None):
+        if defn is None:
+            return lambda defn: self.define_post(defn, starts_with=starts_with)
+        if starts_with is not None:
+            defn.starts_with = frozenset(starts_with)
         self.post_definitions.append(defn)
+        self.post_dispatch.clear()
+        return defn
 
     def create_parser(self, flags):
         return TokenParser(self, flags)
+
+    def candidates(self, definitions, dispatch):
+        token = self.stream.read(self.stream.index)
+        token_type = token.type if token is not None else None
+        candidates = dispatch.get(token_type)
+        if candidates is None:
+            # keeps definition order, definitions without starts_with are tried for every token
+            candidates = [defn for defn in definitions
+                          if getattr(defn, "starts_with", None) is None or token_type in defn.starts_with]
+            dispatch[token_type] = candidates
+        return candidates
+
+    def _apply(self, defn, parser, *value):
+        starting_index = self.stream.index
+        if self.cache is not None:
+            # the entry keeps value alive, so its id can't be reused by another node while cached
+            key = (starting_index, frozenset(parser.flags), defn) + tuple(id(v) for v in value)
+            entry = self.cache.get(key)
+            if entry is not None:
+                node, self.stream.index, _ = entry
+                return node
+
+        node = None
+        try:
+            node = defn(parser, *value)
+        except TokenParserError:
+            pass
+        if not node:
+            # reset index
+            self.stream.index = starting_index
+
+        if self.cache is not None:
+            self.cache.put(key, (node, self.stream.index, value))
+        return node
     
     def _read_without_post(self, flags):
-        for defn in self.definitions:
-            starting_index = self.stream.index
-            node = None
-            try:
-                node = defn(self.create_parser(flags))
-            except TokenParserError:
-                # reset index
-                pass
+        parser = self.create_parser(flags)
+        for defn in self.candidates(self.definitions, self.dispatch):
+            node = self._apply(defn, parser)
             if node:
                 return node
-            else:
-                self.stream.index = starting_index
 
     def read_without_post(self, flags):
         node = self._read_without_post(flags)
@@ -40,17 +114,11 @@ class Compiler:
         return node
 
     def _read_post(self, flags, value):
-        for defn in self.post_definitions:
-            starting_index = self.stream.index
-            node = None
-            try:
-                node = defn(self.create_parser(flags), value)
-            except TokenParserError:
-                pass
+        parser = self.create_parser(flags)
+        for defn in self.candidates(self.post_definitions, self.post_dispatch):
+            node = self._apply(defn, parser, value)
             if node:
                 return node
-            else:
-                self.stream.index = starting_index
 
     def read_post(self, flags, value):
         node = self._read_post(flags, value)
@@ -75,5 +143,8 @@ class Compiler:
         node = self.read(flags)
         while node is not None:
             nodes.append(node)
+            # top level nodes are never re-parsed, so nothing before this point can be hit again
+            if self.cache is not None:
+                self.cache.clear()
             node = self.read(flags)
         return nodes
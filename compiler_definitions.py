@@ -3,37 +3,37 @@ from node import Node
 
 compiler = Compiler()
 
-@compiler.define
+@compiler.define(starts_with=["word"])
 def define_variable(parser):
     parser.assert_flag("value")
     parser.assert_next_is({ "type": "word" })
     return Node("variable", name=parser.last_content())
 
-@compiler.define
+@compiler.define(starts_with=["period"])
 def define_property(parser):
     parser.assert_flag("value")
     parser.assert_next_is({ "type": "period" })
     parser.assert_next_is({ "type": "word" })
     return Node("property", name=parser.last_content())
 
-@compiler.define
+@compiler.define(starts_with=["whitebreak"])
 def define_whitebreak(parser):
     parser.assert_next_is({ "type": "whitebreak" })
     return Node("whitebreak")
 
-@compiler.define_post
+@compiler.define_post(starts_with=["whitebreak"])
 def define_whitebreak_post(parser, value):
     parser.assert_next_is({ "type": "whitebreak" })
     return Node("whitebreak")
 
-@compiler.define_post
+@compiler.define_post(starts_with=["period"])
 def define_property_access(parser, value):
     parser.assert_flag("value")
     parser.assert_next_is({ "type": "period" })
     parser.assert_next_is({ "type": "word" })
     return Node("property_access", target=value, name=parser.last_content())
 
-@compiler.define_post
+@compiler.define_post(starts_with=["assign"])
 def define_assign(parser, location):
     parser.assert_true(location.type in ["variable", "property", "property_access"])
     parser.assert_flag("value")
@@ -42,7 +42,7 @@ def define_assign(parser, location):
     value = parser.read("value")
     return Node("assign", location=location, value=value)
 
-@compiler.define_post
+@compiler.define_post(starts_with=["bracket_open"])
 def define_function_call(parser, value):
     parser.assert_flag("value")
     parser.assert_next_is({ "type": "bracket_open" })
@@ -52,7 +52,21 @@ def define_function_call(parser, value):
     parser.assert_next_is({ "type": "bracket_close" })
     return Node("function_call", target=value, args=args)
 
-@compiler.define_post
+# loosest first, the order binary operator chains have always been split in
+operator_precedence = {operator: i for i, operator in enumerate(["+", "-", "*", "/", "??", ">", "<", ">=", "<=", "==", "!="])}
+comparators = [">", "<", ">=", "<=", "==", "!="]
+
+def insert_binary_operator(value, operator, next_value):
+    # precedence climbing one operator at a time: an operator that binds tighter than the
+    # root of the tree built so far takes over its right operand instead
+    if value.type == "binary_operator" and operator_precedence[value.operator] < operator_precedence[operator]:
+        right = insert_binary_operator(value.right, operator, next_value)
+        return Node("binary_operator", operator=value.operator, left=value.left, right=right)
+    if value.type == "binary_operator" and value.operator == operator and operator in comparators:
+        raise Exception("cannot use comparators on more than 2 values")
+    return Node("binary_operator", operator=operator, left=value, right=next_value)
+
+@compiler.define_post(starts_with=["binary_operator"])
 def define_binary_operator(parser, value):
     parser.assert_flag("value")
     parser.assert_no_flag("ignore_binary_operator")
@@ -60,14 +74,10 @@ def define_binary_operator(parser, value):
     operator = parser.last_content()
     next_value = parser.read("value", "ignore_binary_operator", "ignore_flow", "ignore_tuple")
 
-    if value.type == "binary_operator":
-        value.values.append(next_value)
-        value.operators.append(operator)
-        return value
-    else:
-        return Node("binary_operator", values=[value, next_value], operators=[operator])
+    # nodes are never mutated in place, a packrat cache may still hand the old one out
+    return insert_binary_operator(value, operator, next_value)
 
-@compiler.define_post
+@compiler.define_post(starts_with=["pipe", "map", "write", "read", "pop"])
 def define_flow(parser, value):
     parser.assert_flag("value")
     parser.assert_no_flag("ignore_flow")
@@ -98,7 +108,7 @@ def parse_argument(parser, arg):
 def parse_arguments(parser, arglist):
     return [parse_argument(parser, arg) for arg in arglist]
 
-@compiler.define_post
+@compiler.define_post(starts_with=["arrow"])
 def define_function(parser, value):
     parser.assert_flag("value")
     parser.assert_no_flag("ignore_function")
@@ -119,7 +129,7 @@ def define_function(parser, value):
 
     return Node("function", arguments=arguments, body=body)
 
-@compiler.define_post
+@compiler.define_post(starts_with=["index"])
 def define_index(parser, value):
     parser.assert_flag("value")
     parser.assert_no_flag("ignore_index")
@@ -127,7 +137,7 @@ def define_index(parser, value):
     index = parser.read("value", "ignore_index", "ignore_flow", "ignore_binary_operator", "ignore_assign", "ignore_tuple")
     return Node("index", target=value, index=index)
 
-@compiler.define
+@compiler.define(starts_with=["curly_open"])
 def define_block(parser):
     parser.assert_flag("value")
     parser.assert_next_is({ "type": "curly_open" })
@@ -135,38 +145,38 @@ def define_block(parser):
     parser.assert_next_is({ "type": "curly_close" })
     return Node("block", body=body)
 
-@compiler.define
+@compiler.define(starts_with=["int"])
 def define_int(parser):
     parser.assert_flag("value")
     parser.assert_next_is({ "type": "int" })
     return Node("int", value=int(parser.last_content()))
 
-@compiler.define
+@compiler.define(starts_with=["float"])
 def define_float(parser):
     parser.assert_flag("value")
     parser.assert_next_is({ "type": "float" })
     return Node("float", value=float(parser.last_content()))
 
-@compiler.define
+@compiler.define(starts_with=["string"])
 def define_string(parser):
     parser.assert_flag("value")
     parser.assert_next_is({ "type": "string" })
     return Node("string", value=parser.last_content()[1:-1])
 
-@compiler.define
+@compiler.define(starts_with=["boolean"])
 def define_boolean(parser):
     parser.assert_flag("value")
     parser.assert_next_is({ "type": "boolean" })
     return Node("boolean", value=parser.last_content() == "true")
 
-@compiler.define
+@compiler.define(starts_with=["binary_operator"])
 def define_negative(parser):
     parser.assert_flag("value")
     parser.assert_next_is({ "type": "binary_operator", "content": "-" })
     value = parser.read("value", "ignore_binary_operator", "ignore_tuple", "ignore_flow", "ignore_assign")
     return Node("negative", value=value)
 
-@compiler.define
+@compiler.define(starts_with=["square_open"])
 def define_list(parser):
     parser.assert_flag("value")
     parser.assert_next_is({ "type": "square_open" })
@@ -178,7 +188,7 @@ def define_list(parser):
         values = [value]
     return Node("list", values=values)
 
-@compiler.define_post
+@compiler.define_post(starts_with=["comma"])
 def define_tuple(parser, value):
     parser.assert_flag("value")
     parser.assert_no_flag("ignore_tuple")
@@ -194,14 +204,13 @@ def define_tuple(parser, value):
         if next_value is None:
             return value
         else:
-            value.values.append(next_value)
-            return value
+            return Node("tuple", values=value.values + [next_value])
     elif next_value is None:
         return Node("tuple", values=[value])
     else:
         return Node("tuple", values=[value, next_value])
 
-@compiler.define
+@compiler.define(starts_with=["bracket_open"])
 def define_wrapped_value(parser):
     parser.assert_flag("value")
     parser.assert_next_is({ "type": "bracket_open" })
@@ -209,7 +218,7 @@ def define_wrapped_value(parser):
     parser.assert_next_is({ "type": "bracket_close" })
     return Node("wrapped", value=value)
 
-@compiler.define
+@compiler.define(starts_with=["if"])
 def define_if(parser):
     parser.assert_flag("value")
     def read_clause():
@@ -233,7 +242,7 @@ def define_if(parser):
     
     return Node("if", if_clause=if_clause, elif_clauses=elif_clauses, else_block=else_block)
 
-@compiler.define
+@compiler.define(starts_with=["case"])
 def define_match(parser):
     parser.assert_flag("value")
     
@@ -253,7 +262,7 @@ def define_match(parser):
 
     return Node("match", cases=cases, else_block=else_block)
 
-@compiler.define
+@compiler.define(starts_with=["for"])
 def define_for(parser):
     parser.assert_flag("value")
     parser.assert_next_is({ "type": "for" })
@@ -264,7 +273,7 @@ def define_for(parser):
     body = parser.read("value")
     return Node("for", variable=variable, iterable=iterable, body=body)
 
-@compiler.define
+@compiler.define(starts_with=["break"])
 def define_break(parser):
     parser.assert_flag("value")
     parser.assert_next_is({ "type": "break" })
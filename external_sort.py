@@ -0,0 +1,66 @@
+import heapq
+import pickle
+import tempfile
+from itertools import islice
+from operator import itemgetter
+
+# Sorting more values than fit in memory. (key, value) pairs are sorted memory_limit at a time, each full
+# run is pickled to a temp file and the runs are merged as they're read back, so only a block of each run
+# is in memory at once. Ties keep the order the pairs came in.
+
+memory_limit = 100000
+# runs merged at once, more than that are first merged into longer runs so few files are open at a time
+fan_in = 64
+# pairs pickled together
+block_size = 1024
+
+first = itemgetter(0)
+
+def write_run(pairs):
+    # a temp file of pairs, read back with read_run
+    file = tempfile.TemporaryFile()
+    pairs = iter(pairs)
+    try:
+        while True:
+            block = list(islice(pairs, block_size))
+            if not block:
+                break
+            pickle.dump(block, file)
+    except (pickle.PicklingError, TypeError, AttributeError) as e:
+        file.close()
+        raise Exception(f"past {memory_limit} values, sorting keeps them in temp files, one of them couldn't be "
+                        f"pickled ({e})")
+    file.seek(0)
+    return file
+
+def read_run(file):
+    try:
+        while True:
+            try:
+                block = pickle.load(file)
+            except EOFError:
+                return
+            yield from block
+    finally:
+        file.close()
+
+def merge(runs, reverse):
+    return heapq.merge(*map(read_run, runs), key=first, reverse=reverse)
+
+def sort_pairs(pairs, reverse=False, limit=None):
+    # an iterator of pairs sorted by their keys
+    limit = limit or memory_limit
+    runs = []
+    current = []
+    for pair in pairs:
+        current.append(pair)
+        if len(current) >= limit:
+            current.sort(key=first, reverse=reverse)
+            runs.append(write_run(current))
+            current = []
+    current.sort(key=first, reverse=reverse)
+    if not runs:
+        return iter(current)
+    while len(runs) >= fan_in:
+        runs = [write_run(merge(runs[i:i + fan_in], reverse)) for i in range(0, len(runs), fan_in)]
+    return heapq.merge(*map(read_run, runs), current, key=first, reverse=reverse)
@@ -4,6 +4,8 @@ from pylib.basic import register as register_basic
 from pylib.io import register as register_io
 from pylib.vector import register as register_vector
 from pylib.math_helpers import register as register_math
+from pylib.aio import register as register_aio
+from pylib.aggregate import register as register_aggregate
 
 global_ctx = Context()
 
@@ -12,3 +14,5 @@ register_basic(global_ctx)
 register_io(global_ctx)
 register_vector(global_ctx)
 register_math(global_ctx)
+register_aio(global_ctx)
+register_aggregate(global_ctx)
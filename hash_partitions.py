@@ -0,0 +1,76 @@
+import pickle
+import tempfile
+
+import external_sort
+
+# Hash joins against more rows than fit in memory. The rows are spread over partition_count temp files by
+# the hash of their keys, and so are the values joined to them, so the values of a partition only ever
+# match rows of the same one, and a single partition's rows are in memory at a time.
+
+partition_count = 64
+
+def add_row(rows, key, row, unique):
+    if unique:
+        if key in rows:
+            raise Exception(f"index_by found more than one row with the key {key!r}, it can only keep one of "
+                            f"each with unique")
+        rows[key] = row
+    else:
+        rows.setdefault(key, []).append(row)
+
+class Partitions:
+    # (key, value) pairs pickled to a temp file by hash(key), a block at a time
+    def __init__(self):
+        self.files = [tempfile.TemporaryFile() for _ in range(partition_count)]
+        self.blocks = [[] for _ in range(partition_count)]
+
+    def add(self, key, value):
+        partition = hash(key) % partition_count
+        block = self.blocks[partition]
+        block.append((key, value))
+        if len(block) >= external_sort.block_size:
+            self.flush(partition)
+
+    def flush(self, partition):
+        block = self.blocks[partition]
+        if not block:
+            return
+        file = self.files[partition]
+        file.seek(0, 2)
+        try:
+            pickle.dump(block, file)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            raise Exception(f"past {external_sort.memory_limit} rows, joins keep them in temp files, one of "
+                            f"them couldn't be pickled ({e})")
+        block.clear()
+
+    def read(self, partition):
+        # the pairs of a partition in the order they were added, it can be read any number of times
+        self.flush(partition)
+        file = self.files[partition]
+        file.seek(0)
+        while True:
+            try:
+                block = pickle.load(file)
+            except EOFError:
+                return
+            position = file.tell()
+            yield from block
+            file.seek(position)
+
+    def close(self):
+        for file in self.files:
+            file.close()
+
+class SpilledIndex:
+    # what index_by gives instead of a dict past external_sort.memory_limit rows, only join can use it
+    def __init__(self, partitions, unique):
+        self.partitions = partitions
+        self.unique = unique
+
+    def load(self, partition):
+        # the rows of a partition as the dict index_by would have made of them
+        rows = {}
+        for key, row in self.partitions.read(partition):
+            add_row(rows, key, row, self.unique)
+        return rows
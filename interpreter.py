@@ -37,9 +37,42 @@ class Context:
         self.variables.update(ctx.variables)
 
 
+# a frame slot whose variable hasn't been assigned yet, lookups carry on to the enclosing scopes
+unset = object()
+
+class Frame(Context):
+    # the context of a function call once its variables are resolved to slots (see resolver.py),
+    # names only ever reach it through lookups passing on to the enclosing contexts
+    def __init__(self, parent, slots):
+        self.parent = parent
+        self.slots = slots
+        self.this = None
+        self.inner_context = False
+
+    def get(self, name):
+        return self.parent.get(name)
+
+    def set(self, name, value):
+        raise Exception(f"cannot set {name} by name in a resolved function frame")
+
+
 class Interpreter:
-    def __init__(self):
-        self.visitors = {}
+    def __init__(self, visitors=None, statement_visitors=None, resolution=None):
+        self.visitors = visitors if visitors is not None else {}
+        # visitors for nodes whose value is thrown away, which can often skip keeping it
+        self.statement_visitors = statement_visitors if statement_visitors is not None else {}
+        self.resolution = resolution
+
+    def copy(self, resolution=None):
+        return Interpreter(visitors=self.visitors, statement_visitors=self.statement_visitors, resolution=resolution)
+
+    def address(self, node):
+        if self.resolution is not None:
+            return self.resolution.addresses.get(node)
+
+    def frame(self, node):
+        if self.resolution is not None:
+            return self.resolution.frames.get(node)
 
     def visitor(self, name):
         def decorator(func):
@@ -47,18 +80,31 @@ class Interpreter:
             return func
         return decorator
 
+    def statement_visitor(self, name):
+        def decorator(func):
+            self.statement_visitors[name] = func
+            return func
+        return decorator
+
     def visit(self, node):
         if node.type in self.visitors:
             return self.visitors[node.type](self, node)
         else:
             raise Exception(f"No visitor defined for node type {node.type}")
 
-    def visit_all(self, nodes):
-        values = [self.visit(node) for node in nodes]
+    def visit_statement(self, node):
+        if node.type in self.statement_visitors:
+            return self.statement_visitors[node.type](self, node)
+        return self.visit(node)
+
+    def visit_all(self, nodes, discard_last=False):
+        # with discard_last the value of the last node is thrown away too, the executor returns None
+        last = self.visit_statement if discard_last else self.visit
+        values = [self.visit_statement(node) for node in nodes[:-1]] + [last(node) for node in nodes[-1:]]
         def executor(ctx):
             value = None
             for v in values:
                 value = v(ctx)
-            return value
+            return None if discard_last else value
         return executor
 
@@ -1,22 +1,58 @@
-from interpreter import Interpreter
-from functools import reduce
-
-from pipe_stream import PipeStream, StopPipeException
+import inspect
+import operator
+import sys
+import types
+from collections import deque
+from concurrent.futures import Future
+
+from interpreter import Interpreter, Frame, unset
+from optimizer import is_literal
+
+import async_stream
+import numpy_backend
+from pipe_stream import PipeStream, StopPipeException, default_executor, default_close, read_batch, execute_batch, \
+    ThreadedPipeStream, thread_stage, stream_mark
 from pylib.vector import Vector
+from window_buffer import WindowView
 
 interpreter = Interpreter()
 
 def get_property(target, property):
     if isinstance(target, dict):
         return target.get(property, None)
-    elif isinstance(target, list) or isinstance(target, tuple):
-        try:
-            return target[property]
-        except:
-            return None
+    elif isinstance(target, (list, tuple, WindowView)):
+        return get_item(target, property)
     else:
         return getattr(target, property, None)
 
+def get_key(target, property):
+    return target.get(property, None)
+
+def get_item(target, property):
+    try:
+        return target[property]
+    except (IndexError, TypeError):
+        return None
+
+def get_attribute(target, property):
+    return getattr(target, property, None)
+
+def property_getter(cls):
+    # what get_property does for a target of type cls
+    if issubclass(cls, dict):
+        return dict.get if cls is dict else get_key
+    elif issubclass(cls, (list, tuple, WindowView)):
+        return get_item
+    else:
+        return get_attribute
+
+def property_setter(cls):
+    # what set_property does for a target of type cls, apart from returning the value
+    if issubclass(cls, (dict, list)):
+        return operator.setitem
+    else:
+        return setattr
+
 def set_property(target, property, value):
     if isinstance(target, dict) or isinstance(target, list):
         target[property] = value
@@ -30,68 +66,172 @@ def call_function(target, args):
     else:
         return target(args)
 
-def split_operators(values, operators, operator):
-    split_values = []
-    split_operators = []
-    last_i = 0
-    for i, op in enumerate(operators):
-        if op == operator:
-            split_values.append(values[last_i:(i+1)])
-            split_operators.append(operators[last_i:i])
-            last_i = i + 1
-    split_values.append(values[last_i:len(values)])
-    split_operators.append(operators[last_i:len(operators)])
-    return zip(split_values, split_operators)
-
-def create_operator_executor(values, operator):
+def ancestor(ctx, hops):
+    for _ in range(hops):
+        ctx = ctx.parent
+    return ctx
+
+# Property access caches the accessor for the type of the target it last saw, per spot in the program.
+# The same spot almost always sees the same type, so the isinstance checks only run when it changes.
+
+def create_property_reader(target, name):
+    cached_type = None
+    accessor = None
+    def executor(ctx):
+        nonlocal cached_type, accessor
+        receiver = target(ctx)
+        if type(receiver) is not cached_type:
+            cached_type = type(receiver)
+            accessor = property_getter(cached_type)
+        return accessor(receiver, name)
+    return executor
+
+def create_index_reader(target, index):
+    cached_type = None
+    accessor = None
+    def executor(ctx):
+        nonlocal cached_type, accessor
+        receiver = target(ctx)
+        if type(receiver) is not cached_type:
+            cached_type = type(receiver)
+            accessor = property_getter(cached_type)
+        return accessor(receiver, index(ctx))
+    return executor
+
+def create_property_writer(target, name, value):
+    cached_type = None
+    accessor = None
+    def executor(ctx):
+        nonlocal cached_type, accessor
+        receiver = target(ctx)
+        evaluated = value(ctx)
+        if type(receiver) is not cached_type:
+            cached_type = type(receiver)
+            accessor = property_setter(cached_type)
+        accessor(receiver, name, evaluated)
+        return evaluated
+    return executor
+
+def get_this(ctx):
+    return ctx.this
+
+def create_lookup_step(name, kind, hops, slot, fallback):
+    if kind == "global":
+        if hops == 0:
+            return lambda ctx: ctx.get(name)
+        return lambda ctx: ancestor(ctx, hops).get(name)
+    elif kind == "dict":
+        def lookup(ctx):
+            variables = ancestor(ctx, hops).variables
+            if name in variables:
+                return variables[name]
+            return fallback(ctx)
+        return lookup
+    elif hops == 0:
+        def lookup(ctx):
+            value = ctx.slots[slot]
+            return fallback(ctx) if value is unset else value
+        return lookup
+    else:
+        def lookup(ctx):
+            value = ancestor(ctx, hops).slots[slot]
+            return fallback(ctx) if value is unset else value
+        return lookup
+
+def create_lookup(name, address):
+    # chains the lookups for each candidate of a resolved address, innermost first
+    lookup = None
+    for kind, hops, slot in reversed(address):
+        lookup = create_lookup_step(name, kind, hops, slot, lookup)
+    return lookup
+
+def create_setter(name, address):
+    kind, hops, slot = address
+    if kind == "dict":
+        return lambda ctx, value: ancestor(ctx, hops).set(name, value)
+    elif hops == 0:
+        def setter(ctx, value):
+            ctx.slots[slot] = value
+            return value
+        return setter
+    else:
+        def setter(ctx, value):
+            ancestor(ctx, hops).slots[slot] = value
+            return value
+        return setter
+
+# whether operations specialize for the types they see, see specialize
+adaptive = sys.implementation.name == "cpython" and sys.version_info >= (3, 11)
+
+def specialize(func):
+    # a copy of func with a code object of its own. cpython 3.11+ specializes each operation in a code object
+    # for the types it sees, like int + int or str + str, and falls back to the generic one when they change,
+    # but that cache belongs to the code object, which every lambda made by one expression shares. copied,
+    # each plum operator gets its own and only sees the types used at that spot in the program. elsewhere
+    # there's no such cache and the copy would only cost memory
+    if not adaptive:
+        return func
+    return types.FunctionType(func.__code__.replace(), func.__globals__, func.__name__, func.__defaults__,
+                              func.__closure__)
+
+def create_constant_operator_executor(left, constant, operator):
+    # the right operand is a literal, so there is no executor to call for it
     if operator == "+":
-        return lambda ctx: sum(v(ctx) for v in values)
+        return lambda ctx: left(ctx) + constant
     elif operator == "-":
-        return lambda ctx: reduce(lambda t, x: t - x(ctx), values[1:], values[0](ctx))
+        return lambda ctx: left(ctx) - constant
     elif operator == "*":
-        return lambda ctx: reduce(lambda t, x: t * x(ctx), values[1:], values[0](ctx))
+        return lambda ctx: left(ctx) * constant
     elif operator == "/":
-        return lambda ctx: reduce(lambda t, x: t / x(ctx), values[1:], values[0](ctx))
+        return lambda ctx: left(ctx) / constant
+    elif operator == ">":
+        return lambda ctx: left(ctx) > constant
+    elif operator == "<":
+        return lambda ctx: left(ctx) < constant
+    elif operator == ">=":
+        return lambda ctx: left(ctx) >= constant
+    elif operator == "<=":
+        return lambda ctx: left(ctx) <= constant
+    elif operator == "==":
+        return lambda ctx: left(ctx) == constant
+    elif operator == "!=":
+        return lambda ctx: left(ctx) != constant
+    else:
+        raise Exception(f"unknown operator {operator}")
+
+def create_operator_executor(left, right, operator, constant=unset):
+    # constant is the value of the right operand when it's a literal
+    if operator != "??" and constant is not unset:
+        return specialize(create_constant_operator_executor(left, constant, operator))
+    if operator == "+":
+        executor = lambda ctx: left(ctx) + right(ctx)
+    elif operator == "-":
+        executor = lambda ctx: left(ctx) - right(ctx)
+    elif operator == "*":
+        executor = lambda ctx: left(ctx) * right(ctx)
+    elif operator == "/":
+        executor = lambda ctx: left(ctx) / right(ctx)
     elif operator == "??":
         def executor(ctx):
-            for value in values:
-                evaluated = value(ctx)
-                if evaluated is not None:
-                    return evaluated
-            return None
-        return executor
-    elif operator in [">", "<", ">=", "<=", "==", "!="]:
-        if len(values) > 2:
-            raise Exception("cannot use comparators on more than 2 values")
-        if operator == ">":
-            return lambda ctx: values[0](ctx) > values[1](ctx)
-        elif operator == "<":
-            return lambda ctx: values[0](ctx) < values[1](ctx)
-        elif operator == ">=":
-            return lambda ctx: values[0](ctx) >= values[1](ctx)
-        elif operator == "<=":
-            return lambda ctx: values[0](ctx) <= values[1](ctx)
-        elif operator == "==":
-            return lambda ctx: values[0](ctx) == values[1](ctx)
-        elif operator == "!=":
-            return lambda ctx: values[0](ctx) != values[1](ctx)
-
-def parse_binary_operators(visitor, values, operators):
-    if len(operators) == 0:
-        value = visitor.visit(values[0])
-        return lambda ctx: value(ctx)
-    elif all(op == operators[0] for op in operators):
-        values = [visitor.visit(value) for value in values]
-        return create_operator_executor(values, operators[0])
+            evaluated = left(ctx)
+            if evaluated is not None:
+                return evaluated
+            return right(ctx)
+    elif operator == ">":
+        executor = lambda ctx: left(ctx) > right(ctx)
+    elif operator == "<":
+        executor = lambda ctx: left(ctx) < right(ctx)
+    elif operator == ">=":
+        executor = lambda ctx: left(ctx) >= right(ctx)
+    elif operator == "<=":
+        executor = lambda ctx: left(ctx) <= right(ctx)
+    elif operator == "==":
+        executor = lambda ctx: left(ctx) == right(ctx)
+    elif operator == "!=":
+        executor = lambda ctx: left(ctx) != right(ctx)
     else:
-        operator_order = ["+", "-", "*", "/", "??", ">", "<", ">=", "<=", "==", "!="]
-        for operator in operator_order:
-            if operator in operators:
-                split_pairs = split_operators(values, operators, operator)
-                values = [parse_binary_operators(visitor, *pair) for pair in split_pairs]
-                return create_operator_executor(values, operator)
-        else:
-            raise Exception(f"unknown operators {operators}")
+        raise Exception(f"unknown operator {operator}")
+    return specialize(executor)
 
 def wrap_as_stream(value):
     if isinstance(value, PipeStream):
@@ -103,112 +243,285 @@ def wrap_as_stream(value):
     else:
         return PipeStream(iter([value]))
 
-def create_pipe_flow(visitor, node_flow_from, node_flow_to):
-    flow_from = visitor.visit(node_flow_from)
-    flow_to = visitor.visit(node_flow_to)
-    def executor(ctx):
-        from_value = wrap_as_stream(flow_from(ctx))
+def run_pipe_flow(ctx, from_value, flow_to):
+    from_value = wrap_as_stream(from_value)
 
-        sub_ctx = ctx.get_outer().branch(inner=True)
-        sub_ctx.this = from_value
+    sub_ctx = ctx.get_outer().branch(inner=True)
+    sub_ctx.this = from_value
 
-        to_value = flow_to(sub_ctx)
-        return PipeStream(from_value, to_value, stream_converter=from_value.stream_converter)
-    return executor
+    to_value = flow_to(sub_ctx)
+    return PipeStream(from_value, to_value, stream_converter=from_value.stream_converter)
 
-def create_map_flow(visitor, node_flow_from, node_flow_to):
-    flow_from = visitor.visit(node_flow_from)
-    flow_to = visitor.visit(node_flow_to)
-    def executor(ctx):
-        from_value = wrap_as_stream(flow_from(ctx))
+def run_map_flow(ctx, from_value, flow_to, vectorized=None):
+    from_value = wrap_as_stream(from_value)
 
-        sub_ctx = ctx.get_outer().branch(inner=True)
-        sub_ctx.this = from_value
+    sub_ctx = ctx.get_outer().branch(inner=True)
+    sub_ctx.this = from_value
 
-        to_value = flow_to(sub_ctx)
-        return PipeStream(from_value, lambda upstream, this: call_function(to_value, next(upstream)), stream_converter=from_value.stream_converter)
-    return executor
+    to_value = flow_to(sub_ctx)
+    vector = None
+    if numpy_backend.enabled:
+        vector = vectorized(sub_ctx) if vectorized is not None else numpy_backend.vectorize_builtin(to_value)
+    return fuse_map(from_value, to_value, vector)
 
-def create_write_flow(visitor, node_flow_from, node_flow_to):
-    flow_from = visitor.visit(node_flow_from)
-    
-    if node_flow_to.type == "variable":
-        setter = lambda inner, outer, values: outer.set(node_flow_to.name, values)
-    elif node_flow_to.type == "property":
-        setter = lambda inner, outer, values: set_property(inner.this, node_flow_to.name, values)
-    elif node_flow_to.type == "property_access":
-        target = visitor.visit(node_flow_to.target)
-        setter = lambda inner, outer, values: set_property(target(outer), node_flow_to.name, values)
+def create_mapping_executor(executor, this, functions, vectors=None):
+    # executor's value, or the next one from upstream without one, through each of functions in turn
+    vectorized = vectors is not None and None not in vectors
+    if async_stream.loop is not None and not vectorized:
+        # vectorized functions are builtins, only the others can give something to await
+        return create_async_mapping(executor, this, functions)
+    if executor is None and len(functions) == 1:
+        function = functions[0]
+        mapping = lambda upstream, _: call_function(function, next(upstream))
     else:
-        raise Exception("invalid write flow, can only write into a variable, property or property accessor")
+        def mapping(upstream, _):
+            value = next(upstream) if executor is None else executor(upstream, this)
+            for function in functions:
+                # call_function, inlined
+                value = function(*value) if isinstance(value, tuple) else function(value)
+            return value
+    # with every function vectorized, see numpy_backend.py, a batch is mapped as arrays when it can be
+    vector_batch = getattr(executor, "vector_batch", None) if vectorized else None
+    def batch(upstream, _, size):
+        if vector_batch is not None:
+            values = vector_batch(upstream, this, size)
+        else:
+            values = read_batch(upstream, size) if executor is None else execute_batch(executor, upstream, this, size)
+        if vectorized:
+            mapped = numpy_backend.map_batch(values, vectors)
+            if mapped is not None:
+                return mapped
+            values = values if isinstance(values, list) else values.tolist()
+        for function in functions:
+            mapped = []
+            try:
+                for value in values:
+                    mapped.append(function(*value) if isinstance(value, tuple) else function(value))
+            except StopIteration:
+                # a break, the stream ends with the values before it
+                pass
+            values = mapped
+        return values
+    mapping.batch = batch
+    return mapping
+
+def fuse_map(stream, function, vector=None):
+    # a map over a stream that only maps or pipes takes the place of that stream instead of pulling from it,
+    # so a chain of maps is a single stream, a single call and a single StopIteration check per element.
+    # the stream being mapped is still there for anything else using it, streams with something to close
+    # are left alone so they still close themselves when they end
+    if type(stream) is ThreadedPipeStream and not stream.producer.started and type(stream.stream) is PipeStream \
+            and stream.stream.close is default_close:
+        # a stage that isn't running yet, the map takes its place on its thread instead
+        stream = stream.stream
+    if type(stream) is not PipeStream or stream.close is not default_close:
+        executor, this, functions, vectors = None, None, [function], [vector]
+        source = stream
+    elif stream.mapping is not None:
+        executor, this, functions, vectors = stream.mapping
+        functions, vectors = functions + [function], vectors + [vector]
+        source = stream.source
+    elif stream.executor is default_executor:
+        executor, this, functions, vectors = None, None, [function], [vector]
+        source = stream.source
+    else:
+        executor, this, functions, vectors = stream.executor, stream.this, [function], [vector]
+        source = stream.source
+    fused = PipeStream(source, create_mapping_executor(executor, this, functions, vectors),
+                       stream_converter=stream.stream_converter)
+    fused.mapping = (executor, this, functions, vectors)
+    # it reads from what stream reads from, so it's as old as stream
+    fused.created = stream.created
+    return fused
+
+def create_async_mapping(executor, this, functions):
+    # create_mapping_executor's mapping for --async. a value one of functions returns awaitable is run on the
+    # loop, the functions after it go on from its result once it's done. while values keep needing to be
+    # awaited the map reads ahead, up to async_stream.concurrency of them in flight, values still come out in
+    # order, and so does anything raised, after the values before it. a map whose functions return plain
+    # values reads a value at a time like any other
+    pending = deque()
+    awaiting = False
+    ended = False
+    def apply(value, start):
+        # value through functions from start on, or a future of the first awaitable and where to go on from
+        for i in range(start, len(functions)):
+            value = call_function(functions[i], value)
+            if inspect.isawaitable(value):
+                return async_stream.submit(value), i + 1
+        return value, None
+    def mapping(upstream, _):
+        nonlocal awaiting, ended
+        while not ended and (not pending or (awaiting and len(pending) < async_stream.concurrency)):
+            try:
+                entry = apply(next(upstream) if executor is None else executor(upstream, this), 0)
+            except (StopIteration, StopPipeException):
+                # the end of upstream or a break, the values already in flight still come out
+                ended = True
+                break
+            except Exception as e:
+                ended = True
+                failed = Future()
+                failed.set_exception(e)
+                entry = failed, len(functions)
+            awaiting = entry[1] is not None
+            pending.append(entry)
+        if not pending:
+            raise StopIteration
+        value, rest = pending.popleft()
+        while rest is not None:
+            value, rest = apply(value.result(), rest)
+        return value
+    return mapping
 
-    def executor(ctx):
-        from_value = wrap_as_stream(flow_from(ctx))
-        values = []
-        try:
-            while True:
-                values.append(next(from_value))
-        except StopPipeException:
-            pass
-        values = from_value.convert_stream(values)
+def run_write_flow(ctx, from_value, setter):
+    from_value = wrap_as_stream(from_value)
+    values = from_value.convert_stream(from_value.read_all())
 
-        outer_ctx = ctx.get_outer()
-        setter(ctx, outer_ctx, values)
-        return values
-    return executor
+    outer_ctx = ctx.get_outer()
+    setter(ctx, outer_ctx, values)
+    return values
 
-def create_read_flow(visitor, node_flow_from, node_flow_to):
-    flow_from = visitor.visit(node_flow_from)
-    flow_to = visitor.visit(node_flow_to)
-    def executor(ctx):
-        from_value = wrap_as_stream(flow_from(ctx))
-        
-        sub_ctx = ctx.get_outer().branch(inner=True)
-        sub_ctx.this = from_value
+def run_read_flow(ctx, from_value, flow_to):
+    from_value = wrap_as_stream(from_value)
+
+    sub_ctx = ctx.get_outer().branch(inner=True)
+    sub_ctx.this = from_value
 
-        to_value = flow_to(sub_ctx)
+    to_value = flow_to(sub_ctx)
 
-        values = []
+    values = []
+    size = from_value.chunk_size
+    if size > 1:
+        while True:
+            chunk = from_value.next_batch(size)
+            values.extend([call_function(to_value, value) for value in chunk])
+            if len(chunk) < size:
+                break
+    else:
         try:
             while True:
                 values.append(call_function(to_value, next(from_value)))
         except StopPipeException:
             pass
-        values = from_value.convert_stream(values)
-            
-        return wrap_as_stream(values)
-    return executor
+    values = from_value.convert_stream(values)
+
+    return wrap_as_stream(values)
+
+def run_discarded_read_flow(ctx, from_value, flow_to):
+    # a read flow whose value isn't used, nothing is kept so a stream of any length runs in constant memory
+    from_value = wrap_as_stream(from_value)
+
+    sub_ctx = ctx.get_outer().branch(inner=True)
+    sub_ctx.this = from_value
+
+    to_value = flow_to(sub_ctx)
+
+    size = from_value.chunk_size
+    if size > 1:
+        while True:
+            chunk = from_value.next_batch(size)
+            for value in chunk:
+                call_function(to_value, value)
+            if len(chunk) < size:
+                return None
+    try:
+        while True:
+            call_function(to_value, next(from_value))
+    except StopPipeException:
+        return None
+
+def run_pop_flow(from_value):
+    return next(wrap_as_stream(from_value))
+
+def create_write_setter(node_flow_to, address, target=None):
+    # target evaluates the target of a property access in the outer context
+    if node_flow_to.type == "variable" and address is not None:
+        assign = create_setter(node_flow_to.name, address)
+        return lambda inner, outer, values: assign(inner, values)
+    elif node_flow_to.type == "variable":
+        return lambda inner, outer, values: outer.set(node_flow_to.name, values)
+    elif node_flow_to.type == "property":
+        return lambda inner, outer, values: set_property(inner.this, node_flow_to.name, values)
+    elif node_flow_to.type == "property_access":
+        return lambda inner, outer, values: set_property(target(outer), node_flow_to.name, values)
+    else:
+        raise Exception("invalid write flow, can only write into a variable, property or property accessor")
+
+def reads_alone(node):
+    # whether the stream node makes may be read by nothing but the flow it's the source of, so with
+    # --threaded it can run ahead on a thread of its own. flows and calls can make new streams, whether
+    # they did is only known once they've run, see thread_stage
+    return ThreadedPipeStream.enabled and node.type in ["flow", "function_call"]
+
+def visit_flow_source(visitor, node):
+    flow_from = visitor.visit(node)
+    if reads_alone(node):
+        def executor(ctx):
+            # a stream made while node ran, reading only from streams also made then, isn't held by
+            # anything else. one that reads from an older stream, like a variable's, is left alone
+            mark = stream_mark()
+            return thread_stage(flow_from(ctx), mark)
+        return executor
+    return flow_from
+
+def create_pipe_flow(visitor, node_flow_from, node_flow_to):
+    flow_from = visit_flow_source(visitor, node_flow_from)
+    flow_to = visitor.visit(node_flow_to)
+    return lambda ctx: run_pipe_flow(ctx, flow_from(ctx), flow_to)
+
+def create_map_flow(visitor, node_flow_from, node_flow_to):
+    flow_from = visit_flow_source(visitor, node_flow_from)
+    flow_to = visitor.visit(node_flow_to)
+    if numpy_backend.enabled and node_flow_to.type == "function":
+        vectorized = numpy_backend.vectorize_function(visitor, node_flow_to)
+        return lambda ctx: run_map_flow(ctx, flow_from(ctx), flow_to, vectorized)
+    return lambda ctx: run_map_flow(ctx, flow_from(ctx), flow_to)
+
+def create_write_flow(visitor, node_flow_from, node_flow_to):
+    flow_from = visit_flow_source(visitor, node_flow_from)
+    target = visitor.visit(node_flow_to.target) if node_flow_to.type == "property_access" else None
+    setter = create_write_setter(node_flow_to, visitor.address(node_flow_to), target)
+    return lambda ctx: run_write_flow(ctx, flow_from(ctx), setter)
+
+def create_read_flow(visitor, node_flow_from, node_flow_to, discarded=False):
+    flow_from = visit_flow_source(visitor, node_flow_from)
+    flow_to = visitor.visit(node_flow_to)
+    if discarded:
+        return lambda ctx: run_discarded_read_flow(ctx, flow_from(ctx), flow_to)
+    return lambda ctx: run_read_flow(ctx, flow_from(ctx), flow_to)
 
 def create_pop_flow(visitor, node_flow_from):
     flow_from = visitor.visit(node_flow_from)
-    def executor(ctx):
-        from_value = wrap_as_stream(flow_from(ctx))
-        return next(from_value)
-    return executor
+    return lambda ctx: run_pop_flow(flow_from(ctx))
 
 @interpreter.visitor("variable")
 def visit_variable(visitor, node):
+    address = visitor.address(node)
+    if address is not None:
+        return create_lookup(node.name, address)
     return lambda ctx: ctx.get(node.name)
 
 @interpreter.visitor("property")
 def visit_property(visitor, node):
-    return lambda ctx: get_property(ctx.this, node.name)
+    return create_property_reader(get_this, node.name)
 
 @interpreter.visitor("property_access")
 def visit_property_access(visitor, node):
-    value = visitor.visit(node.target)
-    return lambda ctx: get_property(value(ctx), node.name)
+    return create_property_reader(visitor.visit(node.target), node.name)
 
 @interpreter.visitor("assign")
 def visit_assign(visitor, node):
     value = visitor.visit(node.value)
-    if node.location.type == "variable":
+    if node.location.type == "variable" and visitor.address(node.location) is not None:
+        setter = create_setter(node.location.name, visitor.address(node.location))
+        return lambda ctx: setter(ctx, value(ctx))
+    elif node.location.type == "variable":
         return lambda ctx: ctx.set(node.location.name, value(ctx))
     elif node.location.type == "property":
-        return lambda ctx: set_property(ctx.this, node.location.name, value(ctx))
+        return create_property_writer(get_this, node.location.name, value)
     elif node.location.type == "property_access":
-        target = visitor.visit(node.location.target)
-        return lambda ctx: set_property(target(ctx), node.location.name, value(ctx))
+        return create_property_writer(visitor.visit(node.location.target), node.location.name, value)
     else:
         raise Exception(f"cannot assign {node.location.type} to a value, must be a variable or property")
 
@@ -220,7 +533,8 @@ def visit_function_call(visitor, node):
 
 @interpreter.visitor("binary_operator")
 def visit_binary_operator(visitor, node):
-    return parse_binary_operators(visitor, node.values, node.operators)
+    constant = node.right.value if is_literal(node.right) else unset
+    return create_operator_executor(visitor.visit(node.left), visitor.visit(node.right), node.operator, constant)
 
 @interpreter.visitor("flow")
 def visit_flow(visitor, node):
@@ -238,6 +552,12 @@ def visit_flow(visitor, node):
     else:
         raise Exception(f"unknown flow type {flow_type}")
 
+@interpreter.statement_visitor("flow")
+def visit_flow_statement(visitor, node):
+    if node.flow_type == "read":
+        return create_read_flow(visitor, node.flow_from, node.flow_to, discarded=True)
+    return visit_flow(visitor, node)
+
 def bind_arguments(ctx, values, args):
     for i, arg in enumerate(args):
         if i < len(values):
@@ -249,9 +569,41 @@ def bind_arguments(ctx, values, args):
         else:
             break
 
+def bind_slots(slots, values, argument_slots):
+    for i, slot in enumerate(argument_slots):
+        if i < len(values):
+            value = values[i]
+            if isinstance(slot, list):
+                bind_slots(slots, value, slot)
+            else:
+                slots[slot] = value
+        else:
+            break
+
+def visit_resolved_function(body, size, argument_slots):
+    count = len(argument_slots)
+    if argument_slots == list(range(count)):
+        # plain distinct arguments take the first slots in order
+        def executor(ctx):
+            def func(*values):
+                slots = list(values[:count])
+                slots.extend([unset] * (size - len(slots)))
+                return body(Frame(ctx, slots))
+            return func
+    else:
+        def executor(ctx):
+            def func(*values):
+                slots = [unset] * size
+                bind_slots(slots, values, argument_slots)
+                return body(Frame(ctx, slots))
+            return func
+    return executor
+
 @interpreter.visitor("function")
 def visit_function(visitor, node):
     body = visitor.visit(node.body)
+    if visitor.frame(node) is not None:
+        return visit_resolved_function(body, *visitor.frame(node))
     arguments = node.arguments
     def executor(ctx):
         def func(*values):
@@ -263,13 +615,11 @@ def visit_function(visitor, node):
 
 @interpreter.visitor("index")
 def visit_index(visitor, node):
-    target = visitor.visit(node.target)
-    index = visitor.visit(node.index)
-    return lambda ctx: get_property(target(ctx), index(ctx))
+    return create_index_reader(visitor.visit(node.target), visitor.visit(node.index))
 
 @interpreter.visitor("block")
 def visit_int(visitor, node):
-    body = [visitor.visit(v) for v in node.body]
+    body = [visitor.visit_statement(v) for v in node.body[:-1]] + [visitor.visit(v) for v in node.body[-1:]]
     def executor(ctx):
         value = None
         for v in body:
@@ -330,7 +680,7 @@ def visit_if(visitor, node):
 
 @interpreter.visitor("match")
 def visit_match(visitor, node):
-    cases = [[visitor.visit(cond), visitor.visit(body)] for cond, body in node.cases]
+    cases = [[visitor.visit(case.condition), visitor.visit(case.body)] for case in node.cases]
     else_block = visitor.visit(node.else_block) if node.else_block else None
     def executor(ctx):
         for case in cases:
@@ -346,10 +696,14 @@ def visit_for(visitor, node):
     variable = node.variable
     body = visitor.visit(node.body)
     iterable = visitor.visit(node.iterable)
+    if visitor.address(node) is not None:
+        setter = create_setter(variable, visitor.address(node))
+    else:
+        setter = lambda ctx, x: ctx.set(variable, x)
     def executor(ctx):
         value = None
         for x in iterable(ctx):
-            ctx.set(variable, x)
+            setter(ctx, x)
             value = body(ctx)
         return value
     return executor
@@ -1,11 +1,78 @@
 
 class Node:
+    __slots__ = ("type",)
+    fields = ()
+    field_set = frozenset()
+    # node type -> the slotted Node subclass holding its fields
+    classes = {}
+
+    def __new__(cls, *args, **properties):
+        if cls is Node:
+            node_type = args[0]
+            cls = Node.classes.get(node_type)
+            if cls is None:
+                cls = define_node(node_type, *properties)
+            elif not properties.keys() <= cls.field_set:
+                # slots can't be added to a class, so the type gets a new one with the fields of both. nodes
+                # made before keep the old class, which still works for them
+                cls = define_node(node_type, *cls.fields, *(key for key in properties if key not in cls.field_set))
+        return object.__new__(cls)
+
     def __init__(self, type, **properties):
         self.type = type
         for key, value in properties.items():
             setattr(self, key, value)
+
+    def __reduce__(self):
+        # rebuilt through Node, the class it was made with may have been replaced since
+        properties = self.__dict__
+        return rebuild_node, (properties.pop("type"), properties)
+
+    @property
+    def __dict__(self):
+        # slotted nodes have no real __dict__, this keeps vars() and anything printing nodes working
+        properties = {"type": self.type}
+        for field in self.fields:
+            if hasattr(self, field):
+                properties[field] = getattr(self, field)
+        return properties
     
     def __str__(self):
         parse_value = lambda v: str(v) if not isinstance(v, list) and not isinstance(v, tuple) else f"({', '.join(parse_value(sv) for sv in v)})"
         params = ", ".join(["type"] + [f"{k}={parse_value(v)}" for k, v in self.__dict__.items()])
-        return f"Node({params})"
\ No newline at end of file
+        return f"Node({params})"
+
+def rebuild_node(node_type, properties):
+    return Node(node_type, **properties)
+
+def define_node(node_type, *fields):
+    name = "".join(part.capitalize() for part in node_type.split("_")) + "Node"
+    cls = type(name, (Node,), {"__slots__": fields, "fields": fields, "field_set": frozenset(fields)})
+    Node.classes[node_type] = cls
+    return cls
+
+define_node("variable", "name")
+define_node("property", "name")
+define_node("whitebreak")
+define_node("property_access", "target", "name")
+define_node("assign", "location", "value")
+define_node("function_call", "target", "args")
+define_node("binary_operator", "operator", "left", "right")
+define_node("flow", "flow_type", "flow_from", "flow_to")
+define_node("arguments", "arguments")
+define_node("function", "arguments", "body")
+define_node("index", "target", "index")
+define_node("block", "body")
+define_node("int", "value")
+define_node("float", "value")
+define_node("string", "value")
+define_node("boolean", "value")
+define_node("negative", "value")
+define_node("list", "values")
+define_node("tuple", "values")
+define_node("wrapped", "value")
+define_node("if", "if_clause", "elif_clauses", "else_block")
+define_node("case", "condition", "body")
+define_node("match", "cases", "else_block")
+define_node("for", "variable", "iterable", "body")
+define_node("break")
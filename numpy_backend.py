@@ -0,0 +1,274 @@
+import operator
+
+try:
+    import numpy
+    from numpy.lib.stride_tricks import sliding_window_view
+except ImportError:
+    numpy = None
+
+from interpreter import Frame, unset
+
+# Vectorized stream stages, for when numpy is installed and --numpy is given. They only ever take over a
+# whole batch (see pipe_stream.py) whose values are all numbers, and hand plain python values on, so
+# nothing after them can tell. Whenever a batch can't be done exactly like the element-wise path would do
+# it, like ints that could overflow int64, a division by zero or ints too big for a float to hold exactly,
+# they give up on it with NotVectorizable and the element-wise path runs the batch instead. Nothing here
+# has side effects, so running the batch again is always safe.
+
+enabled = False
+
+class NotVectorizable(Exception):
+    pass
+
+def enable():
+    # does nothing without numpy, everything then stays element-wise
+    global enabled
+    enabled = numpy is not None
+    return enabled
+
+def to_array(values):
+    # values as a 1d array, when they're all ints, all floats or all bools
+    if isinstance(values, numpy.ndarray):
+        return values
+    kinds = set(map(type, values))
+    if len(kinds) != 1:
+        raise NotVectorizable()
+    kind = kinds.pop()
+    if kind is int:
+        try:
+            return numpy.fromiter(values, numpy.int64, len(values))
+        except OverflowError:
+            raise NotVectorizable()
+    elif kind is float:
+        return numpy.fromiter(values, numpy.float64, len(values))
+    elif kind is bool:
+        return numpy.fromiter(values, numpy.bool_, len(values))
+    raise NotVectorizable()
+
+def to_values(result, count):
+    # back to python values, a function of one value may not depend on it at all
+    if isinstance(result, numpy.ndarray):
+        return result.tolist()
+    return [result] * count
+
+def is_int(value):
+    if isinstance(value, numpy.ndarray):
+        return value.dtype.kind in "iub"
+    return isinstance(value, int)
+
+def magnitude(value):
+    # the largest absolute value, as a python int, of an int array or scalar
+    if isinstance(value, numpy.ndarray):
+        return max(int(value.max()), -int(value.min())) if value.size else 0
+    return abs(int(value))
+
+def as_number(value):
+    # arithmetic on bools gives ints in python, numpy would keep them bools
+    if isinstance(value, numpy.ndarray) and value.dtype.kind == "b":
+        return value.astype(numpy.int64)
+    return int(value) if isinstance(value, bool) else value
+
+def check_exact(*values):
+    # ints become floats in numpy where python compares and divides them exactly
+    for value in values:
+        if is_int(value) and magnitude(value) >= 2 ** 53:
+            raise NotVectorizable()
+
+def add(left, right):
+    left, right = as_number(left), as_number(right)
+    if is_int(left) and is_int(right) and magnitude(left) + magnitude(right) >= 2 ** 63:
+        raise NotVectorizable()
+    return left + right
+
+def subtract(left, right):
+    left, right = as_number(left), as_number(right)
+    if is_int(left) and is_int(right) and magnitude(left) + magnitude(right) >= 2 ** 63:
+        raise NotVectorizable()
+    return left - right
+
+def multiply(left, right):
+    left, right = as_number(left), as_number(right)
+    if is_int(left) and is_int(right) and magnitude(left) * magnitude(right) >= 2 ** 63:
+        raise NotVectorizable()
+    return left * right
+
+def divide(left, right):
+    left, right = as_number(left), as_number(right)
+    check_exact(left, right)
+    if numpy.any(right == 0):
+        # python raises, the element-wise path will too
+        raise NotVectorizable()
+    return numpy.true_divide(left, right)
+
+def compare(operation):
+    def comparison(left, right):
+        if is_int(left) != is_int(right):
+            check_exact(left, right)
+        return operation(left, right)
+    return comparison
+
+operations = {
+    "+": add,
+    "-": subtract,
+    "*": multiply,
+    "/": divide,
+    ">": compare(operator.gt),
+    "<": compare(operator.lt),
+    ">=": compare(operator.ge),
+    "<=": compare(operator.le),
+    "==": compare(operator.eq),
+    "!=": compare(operator.ne),
+}
+
+def negate(value):
+    value = as_number(value)
+    if is_int(value) and magnitude(value) >= 2 ** 63 - 1:
+        raise NotVectorizable()
+    return -value
+
+def column(value, index):
+    # w:0 of every window
+    if not isinstance(value, numpy.ndarray) or value.ndim != 2 or not -value.shape[1] <= index < value.shape[1]:
+        raise NotVectorizable()
+    return value[:, index]
+
+def scalar(value):
+    if type(value) not in [int, float, bool] or (type(value) is int and not -2 ** 63 <= value < 2 ** 63):
+        raise NotVectorizable()
+    return value
+
+def convert(function, value):
+    # int and float called on every value
+    if isinstance(value, list):
+        if function is int or function is float:
+            # still python's own conversion of every value, just without a plum call around each one
+            try:
+                return numpy.fromiter(map(function, value), numpy.int64 if function is int else numpy.float64,
+                                      len(value))
+            except OverflowError:
+                raise NotVectorizable()
+        raise NotVectorizable()
+    value = as_number(value)
+    if function is float:
+        if is_int(value) and magnitude(value) >= 2 ** 53:
+            raise NotVectorizable()
+        return value.astype(numpy.float64) if isinstance(value, numpy.ndarray) else float(value)
+    elif function is int:
+        if is_int(value):
+            return value
+        if not numpy.all(numpy.isfinite(value)) or numpy.any(numpy.abs(value) >= 2.0 ** 63):
+            raise NotVectorizable()
+        return value.astype(numpy.int64) if isinstance(value, numpy.ndarray) else int(value)
+    raise NotVectorizable()
+
+def compile_vector(visitor, node, slot):
+    # evaluate(frame, values) running node on a whole batch, values being its argument, or None when node
+    # has anything else in it
+    if node.type == "wrapped":
+        return compile_vector(visitor, node.value, slot)
+    elif node.type == "block" and len(node.body) == 1:
+        return compile_vector(visitor, node.body[0], slot)
+    elif node.type in ["int", "float"]:
+        if node.type == "int" and not -2 ** 63 <= node.value < 2 ** 63:
+            return None
+        value = node.value
+        return lambda frame, values: value
+    elif node.type == "variable":
+        address = visitor.address(node)
+        if address is None:
+            return None
+        if address[0] == ("slot", 0, slot):
+            return lambda frame, values: array(values)
+        if any(kind == "slot" and hops == 0 for kind, hops, _ in address):
+            return None
+        # something further out, the same for every value of the batch
+        lookup = visitor.visit(node)
+        return lambda frame, values: scalar(lookup(frame))
+    elif node.type == "negative":
+        value = compile_vector(visitor, node.value, slot)
+        if value is not None:
+            return lambda frame, values: negate(value(frame, values))
+    elif node.type == "binary_operator" and node.operator in operations:
+        operation = operations[node.operator]
+        left = compile_vector(visitor, node.left, slot)
+        right = compile_vector(visitor, node.right, slot)
+        if left is not None and right is not None:
+            return lambda frame, values: operation(left(frame, values), right(frame, values))
+    elif node.type == "index" and node.index.type == "int":
+        index = node.index.value
+        target = compile_vector(visitor, node.target, slot)
+        if target is not None:
+            return lambda frame, values: column(target(frame, values), index)
+    elif node.type == "function_call" and node.target.type == "variable" and node.args.type != "tuple":
+        address = visitor.address(node.target)
+        value = compile_vector(visitor, node.args, slot)
+        if address is not None and address[0][:2] != ("slot", 0) and value is not None:
+            lookup = visitor.visit(node.target)
+            return lambda frame, values: convert(lookup(frame), value(frame, values))
+    return None
+
+def array(values):
+    return to_array(values) if isinstance(values, list) else values
+
+def vectorize_function(visitor, node):
+    # for a function of one plain argument whose body can run on whole batches, create(ctx) making the
+    # vectorized version of the function defined in ctx
+    frame = visitor.frame(node)
+    if numpy is None or frame is None or len(node.arguments) != 1 or isinstance(node.arguments[0], list):
+        return None
+    size, argument_slots = frame
+    evaluate = compile_vector(visitor, node.body, argument_slots[0])
+    if evaluate is None:
+        return None
+    def create(ctx):
+        # the variables it reads from further out are looked up through a frame of its own
+        frame = Frame(ctx, [unset] * size)
+        return lambda values: evaluate(frame, values)
+    return create
+
+def vectorize_builtin(function):
+    if function is int or function is float:
+        return lambda values: convert(function, values)
+    return None
+
+def map_batch(values, vectors):
+    # values through each vectorized function, as python values, or None to run them element-wise
+    count = len(values)
+    try:
+        for vector in vectors:
+            values = vector(values)
+        return to_values(values, count)
+    except NotVectorizable:
+        return None
+
+def windows(values, size):
+    # the windows of size over values as a 2d view, or None unless values are all numbers
+    try:
+        return sliding_window_view(to_array(values), size)
+    except NotVectorizable:
+        return None
+
+def fold(values, operation, current):
+    # reduce with + or * over a batch, in the same order python would, or unset when it can't be exact
+    try:
+        array = as_number(to_array(values))
+    except NotVectorizable:
+        return unset
+    if array.size == 0 or type(current) not in [int, float, bool]:
+        return unset
+    current = as_number(current)
+    if is_int(array) and isinstance(current, int):
+        bound = magnitude(array)
+        if operation is operator.add:
+            exact = abs(current) + bound * array.size < 2 ** 63
+        else:
+            exact = bound <= 1 or (array.size < 64 and abs(current) * bound ** array.size < 2 ** 63)
+        if not exact:
+            return unset
+    else:
+        check = array if is_int(array) else current
+        if is_int(check) and magnitude(check) >= 2 ** 53:
+            return unset
+    # accumulate goes left to right like the python loop does, so floats round the same way
+    accumulate = numpy.cumsum if operation is operator.add else numpy.cumprod
+    return accumulate(numpy.concatenate(([current], array)))[-1].item()
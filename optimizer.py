@@ -0,0 +1,139 @@
+import operator
+
+from node import Node
+
+literal_types = ["int", "float", "string", "boolean"]
+
+folders = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": operator.truediv,
+    ">": operator.gt,
+    "<": operator.lt,
+    ">=": operator.ge,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+def is_literal(node):
+    return isinstance(node, Node) and node.type in literal_types
+
+def create_literal(value):
+    # bool first, it is a subclass of int
+    if isinstance(value, bool):
+        return Node("boolean", value=value)
+    elif isinstance(value, int):
+        return Node("int", value=value)
+    elif isinstance(value, float):
+        return Node("float", value=value)
+    elif isinstance(value, str):
+        return Node("string", value=value)
+
+class OptimizationReport:
+    def __init__(self):
+        self.folded_operators = 0
+        self.folded_negatives = 0
+        self.collapsed_wrapped = 0
+        self.pruned_branches = 0
+
+    def changes(self):
+        return self.folded_operators + self.folded_negatives + self.collapsed_wrapped + self.pruned_branches
+
+    def __str__(self):
+        return (f"folded {self.folded_operators} operators and {self.folded_negatives} negatives, "
+                f"collapsed {self.collapsed_wrapped} wrapped values, pruned {self.pruned_branches} branches")
+
+class Optimizer:
+    def __init__(self):
+        self.report = OptimizationReport()
+
+    def optimize(self, value):
+        if isinstance(value, Node):
+            optimizer = getattr(self, f"optimize_{value.type}", None)
+            for field in value.fields:
+                if hasattr(value, field):
+                    setattr(value, field, self.optimize(getattr(value, field)))
+            return optimizer(value) if optimizer is not None else value
+        elif isinstance(value, list):
+            return [self.optimize(v) for v in value]
+        elif isinstance(value, tuple):
+            return tuple(self.optimize(v) for v in value)
+        else:
+            return value
+
+    # children are already optimized when these run
+
+    def optimize_wrapped(self, node):
+        self.report.collapsed_wrapped += 1
+        return node.value
+
+    def optimize_binary_operator(self, node):
+        if node.operator == "??" and is_literal(node.left):
+            # a literal is never nothing, so the right hand side is never evaluated
+            self.report.folded_operators += 1
+            return node.left
+        if node.operator not in folders or not is_literal(node.left) or not is_literal(node.right):
+            return node
+        try:
+            folded = create_literal(folders[node.operator](node.left.value, node.right.value))
+        except (TypeError, ValueError, ArithmeticError):
+            # leave it to fail at runtime, like it always has
+            return node
+        if folded is None:
+            return node
+        self.report.folded_operators += 1
+        return folded
+
+    def optimize_negative(self, node):
+        if not is_literal(node.value):
+            return node
+        try:
+            folded = create_literal(-node.value.value)
+        except TypeError:
+            return node
+        self.report.folded_negatives += 1
+        return folded
+
+    def optimize_if(self, node):
+        branches = [node.if_clause] + node.elif_clauses
+        clauses = []
+        else_block = node.else_block
+        for condition, body in branches:
+            if not is_literal(condition):
+                clauses.append((condition, body))
+            elif condition.value:
+                # always taken once reached, anything after it is dead
+                else_block = body
+                break
+
+        if not clauses and else_block is None:
+            # nothing can run, but the node still has to evaluate to nothing
+            return node
+        self.report.pruned_branches += count_branches(branches, node.else_block) - count_branches(clauses, else_block)
+        if not clauses:
+            return else_block
+        return Node("if", if_clause=clauses[0], elif_clauses=clauses[1:], else_block=else_block)
+
+    def optimize_match(self, node):
+        cases = []
+        else_block = node.else_block
+        for case in node.cases:
+            if not is_literal(case.condition):
+                cases.append(case)
+            elif case.condition.value:
+                else_block = case.body
+                break
+
+        self.report.pruned_branches += count_branches(node.cases, node.else_block) - count_branches(cases, else_block)
+        if not cases and else_block is not None:
+            return else_block
+        return Node("match", cases=cases, else_block=else_block)
+
+def count_branches(clauses, else_block):
+    return len(clauses) + (else_block is not None)
+
+def optimize(nodes):
+    optimizer = Optimizer()
+    return optimizer.optimize(nodes), optimizer.report
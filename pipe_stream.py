@@ -1,3 +1,13 @@
+import pickle
+import queue
+import tempfile
+import threading
+from collections import deque
+from itertools import count, islice
+
+
+# numbers the streams in the order they're made
+creations = count()
 
 class StopPipeException(Exception):
     pass
@@ -8,6 +18,33 @@ def default_executor(upstream, this):
 def default_close():
     pass
 
+# An executor can have a batch version as its batch attribute, batch(upstream, this, size) returning the
+# next size values at once. Fewer means the stream has ended. Stages without one are run a value at a
+# time to fill a batch, so they see the same calls either way.
+#
+# An executor can also have vector_batch, the same as batch but free to give an array instead of a list,
+# it's only used by maps that run on arrays, see numpy_backend.py.
+
+def read_batch(upstream, size):
+    # up to size values from upstream, fewer only once it has ended
+    if isinstance(upstream, PipeStream):
+        return upstream.next_batch(size)
+    return list(islice(upstream, size))
+
+def execute_batch(executor, upstream, this, size):
+    batch = getattr(executor, "batch", None)
+    if batch is not None:
+        return batch(upstream, this, size)
+    elif executor is default_executor:
+        return read_batch(upstream, size)
+    values = []
+    try:
+        for _ in range(size):
+            values.append(executor(upstream, this))
+    except (StopIteration, StopPipeException):
+        pass
+    return values
+
 class IterablePipeStream:
     def __init__(self, stream):
         self.stream = stream
@@ -20,12 +57,20 @@ class IterablePipeStream:
             raise StopIteration()
 
 class PipeStream:
+    # values read at a time by flows reading a stream to its end, 1 keeps everything a value at a time.
+    # with more, each stage runs over a whole chunk before the next stage sees any of it
+    chunk_size = 1
+
     def __init__(self, source, executor=None, close=None, stream_converter=None):
         self.source = source
+        # when it was made, see made_since
+        self.created = next(creations)
         self.executor = executor or default_executor
         self.close = close or default_close
         self.stream_converter = stream_converter
         self.this = {}
+        # (executor, this, functions, vectors) when this stream maps the values of another one, see fuse_map
+        self.mapping = None
 
     def __next__(self):
         try:
@@ -41,9 +86,243 @@ class PipeStream:
     def next(self):
         return next(self)
 
+    def next_batch(self, size):
+        values = execute_batch(self.executor, self.source, self.this, size)
+        if len(values) < size:
+            self.close()
+        return values
+
+    def read_all(self):
+        values = []
+        if self.chunk_size > 1:
+            while True:
+                chunk = self.next_batch(self.chunk_size)
+                values.extend(chunk)
+                if len(chunk) < self.chunk_size:
+                    return values
+        try:
+            while True:
+                values.append(next(self))
+        except StopPipeException:
+            return values
+
     def convert_stream(self, values):
         if self.stream_converter is not None:
             return self.stream_converter(values)
         else:
             return values
-    
\ No newline at end of file
+
+    def tee(self, count, memory_limit=None):
+        # count streams of the values of this one, each read at its own pace, see TeeBuffer
+        return TeeBuffer(self, count, memory_limit).streams
+
+class TeeBuffer:
+    # the values of one stream for several readers. only the values between the slowest and the fastest
+    # reader are kept, past memory_limit of them the oldest are pickled to a temp file, which each reader
+    # behind them then reads through in order
+    memory_limit = 100000
+
+    def __init__(self, source, count, memory_limit=None):
+        self.source = source
+        self.memory_limit = memory_limit or self.memory_limit
+        # values dropped from the front of memory are only cut off once they're half of it
+        self.memory = []
+        self.dropped = 0
+        # index of the first value in memory, the values from the slowest reader up to it are in the file
+        self.memory_start = 0
+        self.file = None
+        self.positions = [0] * count
+        # file offset of the next value, for readers behind memory_start
+        self.offsets = [None] * count
+        self.ended = False
+        self.lock = threading.Lock()
+        self.streams = [PipeStream(source, self.create_executor(reader), stream_converter=source.stream_converter)
+                        for reader in range(count)]
+
+    def create_executor(self, reader):
+        def executor(upstream, this):
+            values = self.read(reader, 1)
+            if not values:
+                raise StopIteration
+            return values[0]
+        executor.batch = lambda upstream, this, size: self.read(reader, size)
+        return executor
+
+    def read(self, reader, size):
+        with self.lock:
+            values = []
+            while len(values) < size:
+                position = self.positions[reader]
+                if position < self.memory_start:
+                    self.file.seek(self.offsets[reader])
+                    values.append(pickle.load(self.file))
+                    self.offsets[reader] = self.file.tell()
+                    self.positions[reader] = position + 1
+                elif position < self.memory_start + len(self.memory) - self.dropped:
+                    index = self.dropped + position - self.memory_start
+                    count = min(size - len(values), len(self.memory) - index)
+                    values.extend(self.memory[index:index + count])
+                    self.positions[reader] = position + count
+                elif not self.ended:
+                    self.fill(size - len(values))
+                else:
+                    break
+            self.trim()
+            return values
+
+    def fill(self, size):
+        values = read_batch(self.source, size)
+        self.ended = len(values) < size
+        self.memory.extend(values)
+        self.trim()
+        while len(self.memory) - self.dropped > self.memory_limit:
+            self.spill()
+
+    def spill(self):
+        # the oldest value in memory goes to the end of the file
+        if self.file is None:
+            self.file = tempfile.TemporaryFile()
+        self.file.seek(0, 2)
+        offset = self.file.tell()
+        for reader, position in enumerate(self.positions):
+            if position == self.memory_start:
+                self.offsets[reader] = offset
+        try:
+            pickle.dump(self.memory[self.dropped], self.file)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            raise Exception(f"tee keeps more than {self.memory_limit} values in a temp file past that, "
+                            f"one of them couldn't be pickled ({e})")
+        self.drop(1)
+
+    def drop(self, count):
+        self.dropped += count
+        self.memory_start += count
+        if self.dropped * 2 > len(self.memory):
+            del self.memory[:self.dropped]
+            self.dropped = 0
+
+    def trim(self):
+        # drops what every reader is past, and the file once they're all out of it
+        slowest = min(self.positions)
+        if slowest > self.memory_start:
+            self.drop(min(slowest - self.memory_start, len(self.memory) - self.dropped))
+        if self.file is not None and slowest >= self.memory_start:
+            self.file.close()
+            self.file = None
+    
+
+def stream_mark():
+    # every stream made after this has a larger created than the mark, see made_since
+    return next(creations)
+
+def made_since(stream, mark):
+    # whether stream and every stream it reads from were made after mark, so nothing from before it can be
+    # holding on to one of them and read from it too
+    while isinstance(stream, PipeStream):
+        if stream.created < mark:
+            return False
+        stream = stream.source
+    return True
+
+class Producer:
+    # the thread of a ThreadedPipeStream. it holds nothing of the ThreadedPipeStream, so once a reader drops
+    # that it's collected and stops this, instead of the thread waiting on a full queue forever
+    def __init__(self, stream, batch_size, queue_size):
+        self.stream = stream
+        self.batch_size = batch_size
+        self.queue = queue.Queue(queue_size)
+        self.stopped = threading.Event()
+        self.started = False
+
+    def start(self):
+        self.started = True
+        threading.Thread(target=self.produce, daemon=True).start()
+
+    def produce(self):
+        try:
+            while not self.stopped.is_set():
+                values = self.stream.next_batch(self.batch_size)
+                self.put(values)
+                if len(values) < self.batch_size:
+                    return
+        except BaseException as e:
+            self.put(e)
+
+    def put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def stop(self):
+        # the stage stops after the batch it's reading, whatever it has read ahead is dropped
+        self.stopped.set()
+
+class ThreadedPipeStream(PipeStream):
+    # a stage run ahead on a thread of its own, so it overlaps with whatever reads from it. with --threaded
+    # flows run the streams nothing else can read from like this, see visit_flow_source. values are handed
+    # over batch_size at a time through a queue of queue_size batches, once it's full the stage waits for the
+    # reader. the end of the stage and anything it raises reach the reader in order with the values. close
+    # stops the stage early, and so does dropping the stream
+    enabled = False
+    queue_size = 8
+    batch_size = 64
+
+    def __init__(self, stream):
+        self.producer = Producer(stream, self.batch_size, self.queue_size)
+        super().__init__(stream, self.create_executor(self.producer), close=self.producer.stop,
+                         stream_converter=stream.stream_converter)
+        self.stream = stream
+        self.created = stream.created
+
+    def __del__(self):
+        self.producer.stop()
+
+    @staticmethod
+    def create_executor(producer):
+        buffer = deque()
+        ended = False
+
+        def fill():
+            nonlocal ended
+            if ended:
+                raise StopIteration
+            if not producer.started:
+                producer.start()
+            values = producer.queue.get()
+            if isinstance(values, BaseException):
+                ended = True
+                raise values
+            buffer.extend(values)
+            if len(values) < producer.batch_size:
+                ended = True
+            if not buffer:
+                raise StopIteration
+
+        def executor(upstream, this):
+            if not buffer:
+                fill()
+            return buffer.popleft()
+
+        def executor_batch(upstream, this, size):
+            values = []
+            while len(values) < size:
+                if not buffer:
+                    try:
+                        fill()
+                    except StopIteration:
+                        break
+                while buffer and len(values) < size:
+                    values.append(buffer.popleft())
+            return values
+
+        executor.batch = executor_batch
+        return executor
+
+def thread_stage(value, mark):
+    # value on a thread of its own, when it's a stream nothing made before mark can read from
+    if isinstance(value, PipeStream) and made_since(value, mark):
+        return ThreadedPipeStream(value)
+    return value
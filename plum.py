@@ -1,5 +1,7 @@
+import argparse
 import sys
 
+from ast_cache import ASTCache
 from compiler_definitions import compiler
 from global_context import global_ctx
 from interpreter import Context
@@ -7,22 +9,96 @@ from tokenizer import TokenStream
 from tokenizer_definitions import tokenizer
 from node import Node
 from interpreter_definitions import interpreter
+from vm import execute
+from vm_definitions import bytecode_compiler
+from pyjit_definitions import create_jit_interpreter, compile_program
+from optimizer import optimize
+from pipe_stream import PipeStream, ThreadedPipeStream, TeeBuffer
+import numpy_backend
+import async_stream
+import external_sort
+from resolver import resolve
 
-def run_code(code, ctx):
-    stream = TokenStream(tokenizer, code)
-    nodes = compiler.copy(stream).read_all(["value"])
-    if stream.string:
-        print(f"Syntax error, failed to parse: {stream.string}")
-    executor = interpreter.visit_all(nodes)
+def parse_code(code, packrat=False, cache=None):
+    nodes = cache.load(code) if cache is not None else None
+    if nodes is None:
+        stream = TokenStream(tokenizer, code)
+        nodes = compiler.copy(stream, packrat=packrat).read_all(["value"])
+        if stream.string:
+            print(f"Syntax error, failed to parse: {stream.string}")
+        elif cache is not None:
+            cache.store(code, nodes)
+    return nodes
+
+def run_code(code, ctx, packrat=False, cache=None, optimized=True, report=False, engine="closure", jit_threshold=None,
+             discard_last=False):
+    # with discard_last the value of the last statement isn't needed either, so a flow ending the script
+    # can stream like any other statement, run_code then returns None
+    nodes = parse_code(code, packrat=packrat, cache=cache)
+    if optimized:
+        nodes, optimization_report = optimize(nodes)
+        if report:
+            print(f"optimizer: {optimization_report}", file=sys.stderr)
+    if engine == "vm":
+        return execute(bytecode_compiler.copy(resolve(nodes)).compile_all(nodes, discard_last=discard_last), ctx)
+    if engine == "pyjit":
+        visitor = create_jit_interpreter(jit_threshold).copy(resolve(nodes))
+        if jit_threshold is None:
+            executor = compile_program(visitor, nodes, discard_last)
+        else:
+            executor = visitor.visit_all(nodes, discard_last)
+        return executor(ctx)
+    executor = interpreter.copy(resolve(nodes)).visit_all(nodes, discard_last)
     return executor(ctx)
 
-if len(sys.argv) >= 2:
-    file = sys.argv[1]
+arg_parser = argparse.ArgumentParser(description="run a plum script, or start a repl if no file is given")
+arg_parser.add_argument("file", nargs="?")
+arg_parser.add_argument("--packrat", action="store_true", help="memoize definition results while parsing")
+arg_parser.add_argument("--no-cache", action="store_true", help="always parse the script instead of using the compiled AST cache")
+arg_parser.add_argument("--cache-dir", help="where compiled ASTs are cached, defaults to $PLUM_CACHE_DIR or ~/.cache/plum")
+arg_parser.add_argument("--cache-size", type=int, default=64, help="size limit of the AST cache in megabytes")
+arg_parser.add_argument("--no-optimize", action="store_true", help="skip constant folding and dead branch elimination")
+arg_parser.add_argument("--optimization-report", action="store_true", help="print what the optimizer changed to stderr")
+arg_parser.add_argument("--engine", choices=["closure", "vm", "pyjit"], default="closure",
+                        help="run on the closure interpreter, compile to bytecode for the stack vm or compile to python")
+arg_parser.add_argument("--jit-threshold", type=int,
+                        help="with pyjit, only compile functions once they've been called this many times "
+                             "instead of the whole program up front")
+arg_parser.add_argument("--chunk-size", type=int, default=1,
+                        help="values read through a pipeline at a time, stages that can work on many at once get them "
+                             "as a list")
+arg_parser.add_argument("--numpy", action="store_true",
+                        help="map numeric chunks with numpy where the result is the same, reads 4096 values at a time "
+                             "unless --chunk-size says otherwise, does nothing without numpy installed")
+arg_parser.add_argument("--threaded", action="store_true",
+                        help="run every stage of a pipeline on its own thread, each one reading ahead of the next "
+                             "through a bounded queue")
+arg_parser.add_argument("--async", dest="async_mode", action="store_true",
+                        help="run the script alongside an event loop, so async sources can be read and maps await "
+                             "what their functions return")
+arg_parser.add_argument("--concurrency", type=int, default=16,
+                        help="with --async, awaitables a map has in flight at once")
+arg_parser.add_argument("--memory-limit", type=int,
+                        help="values sort, group_by, distinct and tee keep in memory before the rest go to temp files")
+args = arg_parser.parse_args()
+PipeStream.chunk_size = args.chunk_size
+ThreadedPipeStream.enabled = args.threaded
+async_stream.concurrency = args.concurrency
+if args.memory_limit is not None:
+    external_sort.memory_limit = TeeBuffer.memory_limit = args.memory_limit
+if args.async_mode:
+    async_stream.start_loop()
+if args.numpy and numpy_backend.enable() and args.chunk_size == 1:
+    PipeStream.chunk_size = 4096
 
-    with open(file) as f:
+if args.file is not None:
+    with open(args.file) as f:
         code = f.read()
 
-    run_code(code, global_ctx.branch())
+    cache = None if args.no_cache else ASTCache(args.cache_dir, max_size=args.cache_size * 1024 * 1024)
+    run_code(code, global_ctx.branch(), packrat=args.packrat, cache=cache,
+             optimized=not args.no_optimize, report=args.optimization_report, engine=args.engine,
+             jit_threshold=args.jit_threshold, discard_last=True)
 else:
     ctx = global_ctx.branch()
 
@@ -30,7 +106,8 @@ else:
         line = input("> ")
         if line.strip() == "quit":
             break
-        value = run_code(line, ctx)
+        value = run_code(line, ctx, packrat=args.packrat, optimized=not args.no_optimize, report=args.optimization_report,
+                         engine=args.engine, jit_threshold=args.jit_threshold)
         if value is not None:
             print(value)
 
@@ -0,0 +1,238 @@
+from interpreter import unset
+from interpreter_definitions import get_property, set_property, call_function, create_lookup, create_setter
+from node import Node
+
+# The jit turns plum functions into python source and compiles that with compile(), so cpython's own
+# compiler and specializations take over: a function's slots become python locals, operators become
+# python operators and calls become python calls.
+#
+# A compiled function doesn't get a Frame, it runs in a python frame instead. Variables that live further
+# out are looked up from the context the function was defined in, the Frame's parent, so their addresses
+# are shifted down a hop. Nothing in such a function may need a real context (nested functions, flows),
+# those functions are left to the closure interpreter. The top level of a program does run with a real
+# context and keeps its variables in its dict, so there anything without an emitter is handed to the
+# closure interpreter instead.
+#
+# A local is unset until assigned, like a slot, reading one falls back to the enclosing contexts unless
+# it's certainly been assigned by then.
+
+def destructure(values, count):
+    # the first count values, missing ones left unset like bind_slots does
+    if values is unset:
+        return [unset] * count
+    return [values[i] if i < len(values) else unset for i in range(count)]
+
+def indent(lines):
+    return ["    " + line for line in lines] if lines else ["    pass"]
+
+class Transpiler:
+    def __init__(self, emitters=None, statement_emitters=None, parts=None, visitor=None, shift=0):
+        self.emitters = emitters if emitters is not None else {}
+        # emitters for nodes whose value is thrown away
+        self.statement_emitters = statement_emitters if statement_emitters is not None else {}
+        # node types only found inside others, like the cases of a match
+        self.parts = parts if parts is not None else set()
+        # the interpreter the code would otherwise run on, for its resolution and anything handed back to it
+        self.visitor = visitor
+        # hops from the scope the resolver counted from to the context the code runs with
+        self.shift = shift
+        self.lines = []
+        self.namespace = {"unset": unset, "get_property": get_property, "set_property": set_property,
+                          "call_function": call_function, "destructure": destructure}
+        # slot -> python local
+        self.locals = {}
+        # slots certainly assigned where code is being emitted
+        self.assigned = set()
+        # expressions nothing emitted later can change, which never need saving before it runs
+        self.stable = set()
+        self.temps = 0
+
+    def copy(self, visitor, shift=0):
+        return Transpiler(emitters=self.emitters, statement_emitters=self.statement_emitters, parts=self.parts,
+                          visitor=visitor, shift=shift)
+
+    def address(self, node):
+        return self.visitor.address(node)
+
+    def frame(self, node):
+        return self.visitor.frame(node)
+
+    def emitter(self, name, parts=()):
+        def decorator(func):
+            self.emitters[name] = func
+            self.parts.update(parts)
+            return func
+        return decorator
+
+    def statement_emitter(self, name):
+        def decorator(func):
+            self.statement_emitters[name] = func
+            return func
+        return decorator
+
+    def supports(self, value):
+        # whether everything in value can be emitted without a real context
+        if isinstance(value, Node):
+            if value.type not in self.emitters and value.type not in self.parts:
+                return False
+            return all(self.supports(getattr(value, field, None)) for field in value.fields)
+        elif isinstance(value, (list, tuple)):
+            return all(self.supports(v) for v in value)
+        return True
+
+    def expression(self, node):
+        # python source for the value of node, anything that has to run first goes on self.lines
+        if node.type in self.emitters:
+            return self.emitters[node.type](self, node)
+        # only reached at the top level, see supports
+        return f"{self.constant(self.visitor.visit(node), 'executor')}(ctx)"
+
+    def statement(self, node):
+        if node.type in self.statement_emitters:
+            self.statement_emitters[node.type](self, node)
+            return
+        if node.type not in self.emitters:
+            # only reached at the top level, the interpreter may run it cheaper when its value isn't used
+            self.line(f"{self.constant(self.visitor.visit_statement(node), 'executor')}(ctx)")
+            return
+        value = self.expression(node)
+        if value not in self.stable and not value.isidentifier():
+            self.line(value)
+
+    def expressions(self, nodes):
+        # values evaluated in order, earlier values are saved before any lines a later one needs
+        values = []
+        for node in nodes:
+            start = len(self.lines)
+            value = self.expression(node)
+            if len(self.lines) > start:
+                for i, earlier in enumerate(values):
+                    if earlier not in self.stable:
+                        values[i] = self.temp()
+                        self.lines.insert(start, f"{values[i]} = {earlier}")
+                        start += 1
+            values.append(value)
+        return values
+
+    def branch(self, emit):
+        # runs emit with its lines kept apart, for code that only runs sometimes, so nothing it assigns
+        # is certainly assigned after it
+        lines, certain = self.lines, self.assigned
+        self.lines, self.assigned = [], set(certain)
+        value = emit()
+        branch_lines = self.lines
+        self.lines, self.assigned = lines, certain
+        return value, branch_lines
+
+    def line(self, line):
+        self.lines.append(line)
+
+    def temp(self):
+        name = f"t{self.temps}"
+        self.temps += 1
+        self.stable.add(name)
+        return name
+
+    def constant(self, value, prefix="c"):
+        name = f"{prefix}{len(self.namespace)}"
+        self.namespace[name] = value
+        self.stable.add(name)
+        return name
+
+    def literal(self, value):
+        source = repr(value)
+        self.stable.add(source)
+        return source
+
+    def local(self, slot, name):
+        if slot not in self.locals:
+            self.locals[slot] = f"v{slot}_{name}" if name.isidentifier() else f"v{slot}"
+        return self.locals[slot]
+
+    def this(self):
+        return "ctx.this" if self.shift == 0 else "None"
+
+    def outer(self, address):
+        return [(kind, hops - self.shift, slot) for kind, hops, slot in address]
+
+    def read(self, address, name):
+        kind, hops, slot = address[0]
+        if kind == "slot" and hops == 0:
+            local = self.local(slot, name)
+            if slot in self.assigned:
+                return local
+            fallback = self.constant(create_lookup(name, self.outer(address[1:])), "lookup")
+            return f"({local} if {local} is not unset else {fallback}(ctx))"
+        address = self.outer(address)
+        if self.shift == 0 and address == [("global", 0, None)]:
+            return f"(variables[{name!r}] if {name!r} in variables else ctx.get({name!r}))"
+        return f"{self.constant(create_lookup(name, address), 'lookup')}(ctx)"
+
+    def target(self, address, name):
+        # python source that can be assigned to for a write address, None if it needs a setter
+        kind, hops, slot = address
+        if kind == "slot" and hops == 0:
+            self.assigned.add(slot)
+            return self.local(slot, name)
+        if kind == "dict" and hops == self.shift == 0:
+            return f"variables[{name!r}]"
+        return None
+
+    def write(self, address, name, value):
+        target = self.target(address, name)
+        if target is not None:
+            self.line(f"{target} = {value}")
+            return target
+        if value not in self.stable:
+            target = self.temp()
+            self.line(f"{target} = {value}")
+            value = target
+        setter = self.constant(create_setter(name, (address[0], address[1] - self.shift, address[2])), "setter")
+        self.line(f"{setter}(ctx, {value})")
+        return value
+
+    def unpack(self, source, names, slots):
+        values = self.temp()
+        self.line(f"{values} = destructure({source}, {len(slots)})")
+        for i, (name, slot) in enumerate(zip(names, slots)):
+            if isinstance(slot, list):
+                self.unpack(f"{values}[{i}]", name, slot)
+            else:
+                self.line(f"{self.local(slot, name)} = {values}[{i}]")
+
+    def build(self, source, name):
+        try:
+            exec(compile("\n".join(source), f"<pyjit {name}>", "exec"), self.namespace)
+        except (SyntaxError, RecursionError, MemoryError):
+            # too deeply nested for python, the interpreter can still run it
+            return None
+        return self.namespace[name]
+
+    def transpile_function(self, node):
+        # a function taking the context the plum function is defined in and returning it as a python
+        # function, or None if it can't be compiled
+        if self.frame(node) is None or not self.supports(node.body):
+            return None
+        _, argument_slots = self.frame(node)
+        parameters = []
+        for i, (argument, slot) in enumerate(zip(node.arguments, argument_slots)):
+            if isinstance(slot, list):
+                parameters.append(f"a{i}")
+                self.unpack(f"a{i}", argument, slot)
+            else:
+                parameters.append(self.local(slot, argument))
+        value = self.expression(node.body)
+        # every other local starts out unset, python would have it unbound
+        unbound = [local for local in self.locals.values() if local not in parameters]
+        body = ([" = ".join(unbound + ["unset"])] if unbound else []) + self.lines + [f"return {value}"]
+        signature = ", ".join([f"{parameter}=unset" for parameter in parameters] + ["*_"])
+        return self.build(["def create_function(ctx):", f"    def plum_function({signature}):"]
+                          + indent(indent(body)) + ["    return plum_function"], "create_function")
+
+    def transpile_program(self, nodes, discard_last=False):
+        # an executor running nodes like visit_all's, or None if they can't be compiled
+        for node in nodes if discard_last else nodes[:-1]:
+            self.statement(node)
+        value = self.expression(nodes[-1]) if nodes and not discard_last else "None"
+        body = ["variables = ctx.variables"] + self.lines + [f"return {value}"]
+        return self.build(["def run_program(ctx):"] + indent(body), "run_program")
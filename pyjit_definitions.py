@@ -0,0 +1,247 @@
+import math
+
+from interpreter import Interpreter
+from interpreter_definitions import interpreter, visit_function
+from pyjit import Transpiler, indent
+
+transpiler = Transpiler()
+
+@transpiler.emitter("variable")
+def emit_variable(transpiler, node):
+    return transpiler.read(transpiler.address(node), node.name)
+
+@transpiler.emitter("property")
+def emit_property(transpiler, node):
+    return f"get_property({transpiler.this()}, {node.name!r})"
+
+@transpiler.emitter("property_access")
+def emit_property_access(transpiler, node):
+    return f"get_property({transpiler.expression(node.target)}, {node.name!r})"
+
+@transpiler.emitter("assign")
+def emit_assign(transpiler, node):
+    location = node.location
+    if location.type == "variable":
+        return transpiler.write(transpiler.address(location), location.name, transpiler.expression(node.value))
+    elif location.type == "property":
+        return f"set_property({transpiler.this()}, {location.name!r}, {transpiler.expression(node.value)})"
+    elif location.type == "property_access":
+        target, value = transpiler.expressions([location.target, node.value])
+        return f"set_property({target}, {location.name!r}, {value})"
+    else:
+        raise Exception(f"cannot assign {location.type} to a value, must be a variable or property")
+
+@transpiler.statement_emitter("assign")
+def emit_assign_statement(transpiler, node):
+    value = emit_assign(transpiler, node)
+    if value.startswith("set_property("):
+        transpiler.line(value)
+
+@transpiler.emitter("function_call")
+def emit_function_call(transpiler, node):
+    args = node.args
+    if args.type == "tuple":
+        # splatted by call_function anyway, so the call can be made directly
+        values = transpiler.expressions([node.target] + args.values)
+        return f"{values[0]}({', '.join(values[1:])})"
+    function, value = transpiler.expressions([node.target, args])
+    if args.type in ["int", "float", "string", "boolean", "list"]:
+        return f"{function}({value})"
+    return f"call_function({function}, {value})"
+
+@transpiler.emitter("binary_operator")
+def emit_binary_operator(transpiler, node):
+    if node.operator != "??":
+        left, right = transpiler.expressions([node.left, node.right])
+        return f"({left} {node.operator} {right})"
+    left = transpiler.expression(node.left)
+    right, lines = transpiler.branch(lambda: transpiler.expression(node.right))
+    temp = transpiler.temp()
+    if not lines:
+        return f"({temp} if ({temp} := {left}) is not None else {right})"
+    transpiler.line(f"{temp} = {left}")
+    transpiler.line(f"if {temp} is None:")
+    transpiler.lines.extend(indent(lines + [f"{temp} = {right}"]))
+    return temp
+
+@transpiler.emitter("index")
+def emit_index(transpiler, node):
+    target, index = transpiler.expressions([node.target, node.index])
+    return f"get_property({target}, {index})"
+
+@transpiler.emitter("block")
+def emit_block(transpiler, node):
+    for statement in node.body[:-1]:
+        transpiler.statement(statement)
+    return transpiler.expression(node.body[-1]) if node.body else "None"
+
+@transpiler.statement_emitter("block")
+def emit_block_statement(transpiler, node):
+    for statement in node.body:
+        transpiler.statement(statement)
+
+@transpiler.emitter("int")
+@transpiler.emitter("string")
+@transpiler.emitter("boolean")
+def emit_literal(transpiler, node):
+    return transpiler.literal(node.value)
+
+@transpiler.emitter("float")
+def emit_float(transpiler, node):
+    # inf and nan have no literal in python
+    if math.isfinite(node.value):
+        return transpiler.literal(node.value)
+    return transpiler.constant(node.value)
+
+@transpiler.emitter("list")
+def emit_list(transpiler, node):
+    return f"[{', '.join(transpiler.expressions(node.values))}]"
+
+@transpiler.emitter("tuple")
+def emit_tuple(transpiler, node):
+    values = transpiler.expressions(node.values)
+    return f"({', '.join(values)},)" if values else "()"
+
+@transpiler.emitter("negative")
+def emit_negative(transpiler, node):
+    return f"(-{transpiler.expression(node.value)})"
+
+@transpiler.emitter("wrapped")
+def emit_wrapped(transpiler, node):
+    return transpiler.expression(node.value)
+
+def emit_branches(transpiler, branches, else_block, statement=False):
+    # shared by if and match, the first condition is always evaluated, everything else only sometimes
+    emit = transpiler.statement if statement else transpiler.expression
+    clauses = []
+    for i, (condition, body) in enumerate(branches):
+        if i == 0:
+            condition_lines = []
+            condition = transpiler.expression(condition)
+        else:
+            condition, condition_lines = transpiler.branch(lambda: transpiler.expression(condition))
+        clauses.append((condition_lines, condition) + transpiler.branch(lambda: emit(body)))
+    if else_block is not None:
+        otherwise = transpiler.branch(lambda: emit(else_block))
+    else:
+        otherwise = ("None", [])
+    if not statement and not any(lines for clause in clauses for lines in [clause[0], clause[3]]) \
+            and not otherwise[1]:
+        value = otherwise[0]
+        for _, condition, body, _ in reversed(clauses):
+            value = f"({body} if {condition} else {value})"
+        return value
+    result = None if statement else transpiler.temp()
+    transpiler.lines.extend(chain_branches(clauses, otherwise, result, else_block is not None or not statement))
+    return result
+
+def chain_branches(clauses, otherwise, result, has_else):
+    # an if statement for the clauses, conditions that need lines first nest an if inside an else
+    lines = []
+    for i, (condition_lines, condition, body, body_lines) in enumerate(clauses):
+        if condition_lines:
+            rest = [([], condition, body, body_lines)] + clauses[i + 1:]
+            lines.append("else:")
+            lines.extend(indent(condition_lines + chain_branches(rest, otherwise, result, has_else)))
+            return lines
+        lines.append(f"{'elif' if i > 0 else 'if'} {condition}:")
+        lines.extend(indent(body_lines + ([f"{result} = {body}"] if result is not None else [])))
+    if has_else:
+        lines.append("else:")
+        lines.extend(indent(otherwise[1] + ([f"{result} = {otherwise[0]}"] if result is not None else [])))
+    return lines
+
+@transpiler.emitter("if")
+def emit_if(transpiler, node):
+    return emit_branches(transpiler, [node.if_clause] + node.elif_clauses, node.else_block)
+
+@transpiler.statement_emitter("if")
+def emit_if_statement(transpiler, node):
+    emit_branches(transpiler, [node.if_clause] + node.elif_clauses, node.else_block, statement=True)
+
+@transpiler.emitter("match", parts=["case"])
+def emit_match(transpiler, node):
+    return emit_branches(transpiler, [(case.condition, case.body) for case in node.cases], node.else_block)
+
+@transpiler.statement_emitter("match")
+def emit_match_statement(transpiler, node):
+    emit_branches(transpiler, [(case.condition, case.body) for case in node.cases], node.else_block,
+                  statement=True)
+
+def emit_loop(transpiler, node, statement):
+    iterable = transpiler.expression(node.iterable)
+    address = transpiler.address(node)
+    result = None if statement else transpiler.temp()
+    if result is not None:
+        transpiler.line(f"{result} = None")
+    def emit_body():
+        target = transpiler.target(address, node.variable)
+        if target is None:
+            # set through a setter at the top of the body instead
+            target = transpiler.temp()
+            transpiler.write(address, node.variable, target)
+        if statement:
+            transpiler.statement(node.body)
+            return target, None
+        return target, transpiler.expression(node.body)
+    (target, value), lines = transpiler.branch(emit_body)
+    transpiler.line(f"for {target} in {iterable}:")
+    transpiler.lines.extend(indent(lines + ([f"{result} = {value}"] if result is not None else [])))
+    return result if result is not None else "None"
+
+@transpiler.emitter("for")
+def emit_for(transpiler, node):
+    return emit_loop(transpiler, node, statement=False)
+
+@transpiler.statement_emitter("for")
+def emit_for_statement(transpiler, node):
+    emit_loop(transpiler, node, statement=True)
+
+@transpiler.emitter("break")
+def emit_break(transpiler, node):
+    transpiler.line("raise StopIteration()")
+    return "None"
+
+def create_hot_executor(interpreted, transpile, threshold):
+    # functions run on the closure interpreter until they've been called threshold times between them,
+    # then they're compiled, function values made after that are compiled from the start
+    calls = 0
+    create = None
+    def executor(ctx):
+        if create is not None:
+            return create(ctx)
+        func = interpreted(ctx)
+        compiled = None
+        def hot(*values):
+            nonlocal calls, create, compiled
+            if compiled is not None:
+                return compiled(*values)
+            if create is None:
+                calls += 1
+                if calls <= threshold:
+                    return func(*values)
+                create = transpile() or interpreted
+            compiled = create(ctx)
+            return compiled(*values)
+        return hot
+    return executor
+
+def create_jit_interpreter(threshold=None):
+    # the closure interpreter, with functions compiled up front or once they're hot
+    jit_interpreter = Interpreter(visitors=dict(interpreter.visitors), statement_visitors=interpreter.statement_visitors)
+
+    @jit_interpreter.visitor("function")
+    def visit_compiled_function(visitor, node):
+        interpreted = visit_function(visitor, node)
+        if visitor.frame(node) is None or not transpiler.supports(node.body):
+            return interpreted
+        transpile = lambda: transpiler.copy(visitor, shift=1).transpile_function(node)
+        if threshold is not None:
+            return create_hot_executor(interpreted, transpile, threshold)
+        return transpile() or interpreted
+
+    return jit_interpreter
+
+def compile_program(visitor, nodes, discard_last=False):
+    # the top level is run once, it's compiled so its loops are too
+    return transpiler.copy(visitor).transpile_program(nodes, discard_last) or visitor.visit_all(nodes, discard_last)
@@ -0,0 +1,303 @@
+import heapq
+import math
+import operator
+
+import numpy_backend
+from interpreter import Context, unset
+from interpreter_definitions import call_function
+from pipe_stream import read_batch
+
+# Aggregates summing a stream up in a single read of it. aggregate(...) takes any number of them and gives
+# a single record, a dict of each one's result by its name, so `src :: aggregate(count(), mean(),
+# quantile(0.9)) := stats` reads src once for all three. An aggregate can be given as (name, aggregate)
+# to be found under another name, and most take a function of the value to aggregate instead of it.
+# Every one of them keeps a bounded amount of state however long the stream is.
+
+ctx = Context()
+
+# values read at a time, aggregates take in whole batches
+batch_size = 1024
+
+class Aggregator:
+    # create() makes the state for one stream, a pair of add(values) taking in a batch and result()
+    def __init__(self, name, create, of=None):
+        self.name = name
+        self.create = create
+        self.of = of
+
+    def start(self):
+        add, result = self.create()
+        if self.of is not None:
+            of = self.of
+            add_values = add
+            add = lambda values: add_values([call_function(of, value) for value in values])
+        return add, result
+
+@ctx.use("aggregate")
+def aggregate(*aggregators):
+    names = []
+    parts = []
+    for aggregator in aggregators:
+        if isinstance(aggregator, tuple):
+            name, aggregator = aggregator
+        else:
+            name = getattr(aggregator, "name", None)
+        if not isinstance(aggregator, Aggregator):
+            raise Exception(f"aggregate takes aggregates like count() or mean(), not {aggregator!r}")
+        if name in names:
+            raise Exception(f"aggregate has two results named {name}, give one of them another name as "
+                            f"(name, aggregate)")
+        names.append(name)
+        parts.append(aggregator)
+
+    def run(upstream, size):
+        states = [part.start() for part in parts]
+        while True:
+            values = read_batch(upstream, size)
+            for add, _ in states:
+                add(values)
+            if len(values) < size:
+                break
+        return {name: result() for name, (_, result) in zip(names, states)}
+
+    def aggregator(upstream, this):
+        if "stop" in this:
+            raise StopIteration
+        this["stop"] = True
+        return run(upstream, batch_size)
+
+    def aggregate_batch(upstream, this, size):
+        if "stop" in this:
+            return []
+        this["stop"] = True
+        return [run(upstream, max(size, batch_size))]
+
+    aggregator.batch = aggregate_batch
+    return aggregator
+
+@ctx.use("count")
+def count():
+    def create():
+        total = 0
+        def add(values):
+            nonlocal total
+            total += len(values)
+        return add, lambda: total
+    return Aggregator("count", create)
+
+def adder():
+    # add(values) and result() of the sum of the values, with numpy_backend.fold where it can
+    total = 0
+    def add(values):
+        nonlocal total
+        folded = numpy_backend.fold(values, operator.add, total) if numpy_backend.enabled else unset
+        if folded is unset:
+            for value in values:
+                total = value + total
+        else:
+            total = folded
+    return add, lambda: total
+
+@ctx.use("total")
+def total(of=None):
+    return Aggregator("total", adder, of)
+
+def extreme(better):
+    # the first of the values no other value is better than, None without any
+    def create():
+        best = unset
+        def add(values):
+            nonlocal best
+            for value in values:
+                if best is unset or better(value, best):
+                    best = value
+        return add, lambda: None if best is unset else best
+    return create
+
+@ctx.use("minimum")
+def minimum(of=None):
+    return Aggregator("minimum", extreme(operator.lt), of)
+
+@ctx.use("maximum")
+def maximum(of=None):
+    return Aggregator("maximum", extreme(operator.gt), of)
+
+@ctx.use("mean")
+def mean(of=None):
+    def create():
+        add_total, result_total = adder()
+        seen = 0
+        def add(values):
+            nonlocal seen
+            seen += len(values)
+            add_total(values)
+        return add, lambda: result_total() / seen if seen else None
+    return Aggregator("mean", create, of)
+
+def moments():
+    # Welford's running mean and sum of squared differences from it, which unlike summing squares doesn't
+    # lose everything to rounding when the values are large next to how much they vary
+    seen = 0
+    mean = 0.0
+    squares = 0.0
+    def add(values):
+        nonlocal seen, mean, squares
+        for value in values:
+            seen += 1
+            delta = value - mean
+            mean += delta / seen
+            squares += delta * (value - mean)
+    return add, lambda: (seen, squares)
+
+def spread_of(finish, correction=0):
+    # finish(squares / values) from moments, leaving out correction values, None without enough values
+    def create():
+        add, result = moments()
+        def spread():
+            seen, squares = result()
+            seen -= correction
+            return finish(squares / seen) if seen > 0 else None
+        return add, spread
+    return create
+
+@ctx.use("variance")
+def variance(of=None):
+    return Aggregator("variance", spread_of(float), of)
+
+@ctx.use("sample_variance")
+def sample_variance(of=None):
+    return Aggregator("sample_variance", spread_of(float, 1), of)
+
+@ctx.use("stddev")
+def stddev(of=None):
+    return Aggregator("stddev", spread_of(math.sqrt), of)
+
+@ctx.use("top_k")
+def top_k(k, by=None):
+    # the k largest values, or the k with the largest by(value), largest first. a heap of the k kept so
+    # far has the smallest on top, a value only goes in in place of it. ties go to the earlier value
+    def create():
+        heap = []
+        index = 0
+        def add(values):
+            nonlocal index
+            for value in values:
+                key = value if by is None else call_function(by, value)
+                entry = (key, -index, value)
+                index += 1
+                if len(heap) < k:
+                    heapq.heappush(heap, entry)
+                elif entry[:2] > heap[0][:2]:
+                    heapq.heapreplace(heap, entry)
+        return add, lambda: [entry[2] for entry in sorted(heap, key=lambda entry: entry[:2], reverse=True)]
+    return Aggregator("top_k", create)
+
+def spread(x):
+    # splitmix64's finalizer, python hashes small ints to themselves
+    x = (x ^ (x >> 30)) * 0xbf58476d1ce4e5b9 & 0xffffffffffffffff
+    x = (x ^ (x >> 27)) * 0x94d049bb133111eb & 0xffffffffffffffff
+    return x ^ (x >> 31)
+
+@ctx.use("count_distinct")
+def count_distinct(of=None, precision=14):
+    # how many different values there are. exact while there are few enough to keep in a set, past that
+    # a HyperLogLog estimate, 2 ** precision bytes of registers and about 1.04 / sqrt(2 ** precision) off
+    registers_count = 1 << precision
+    limit = registers_count
+    def create():
+        seen = set()
+        registers = None
+        def insert(value):
+            x = spread((value if type(value) is int else hash(value)) & 0xffffffffffffffff)
+            register = x >> (64 - precision)
+            rank = 64 - precision - (x & ((1 << (64 - precision)) - 1)).bit_length() + 1
+            if rank > registers[register]:
+                registers[register] = rank
+        def add(values):
+            nonlocal registers
+            if registers is None:
+                seen.update(values)
+                if len(seen) <= limit:
+                    return
+                registers = bytearray(registers_count)
+                for value in seen:
+                    insert(value)
+                seen.clear()
+            else:
+                for value in values:
+                    insert(value)
+        def result():
+            if registers is None:
+                return len(seen)
+            alpha = 0.7213 / (1 + 1.079 / registers_count)
+            estimate = alpha * registers_count ** 2 / sum(2.0 ** -rank for rank in registers)
+            zeros = registers.count(0)
+            if estimate <= 2.5 * registers_count and zeros:
+                estimate = registers_count * math.log(registers_count / zeros)
+            return round(estimate)
+        return add, result
+    return Aggregator("count_distinct", create, of)
+
+@ctx.use("quantile")
+def quantile(q, of=None):
+    # the P² estimate of the q quantile, five markers whose heights are moved towards where the quantile
+    # and the points halfway to the ends would be as the values go by. exact up to five values, None
+    # without any
+    desired_steps = [0, q / 2, q, (1 + q) / 2, 1]
+    def create():
+        heights = []
+        positions = [1, 2, 3, 4, 5]
+        desired = [1, 1 + 2 * q, 1 + 4 * q, 3 + 2 * q, 5]
+        def adjust(i, d):
+            # the parabolic prediction of the height, or the linear one when that's out of order
+            below, at, above = positions[i - 1], positions[i], positions[i + 1]
+            height = heights[i] + d / (above - below) * (
+                (at - below + d) * (heights[i + 1] - heights[i]) / (above - at) +
+                (above - at - d) * (heights[i] - heights[i - 1]) / (at - below))
+            if not heights[i - 1] < height < heights[i + 1]:
+                height = heights[i] + d * (heights[i + d] - heights[i]) / (positions[i + d] - at)
+            heights[i] = height
+            positions[i] += d
+        def insert(value):
+            if value < heights[0]:
+                heights[0] = value
+                cell = 0
+            elif value >= heights[4]:
+                heights[4] = value
+                cell = 3
+            else:
+                cell = 0
+                while value >= heights[cell + 1]:
+                    cell += 1
+            for i in range(cell + 1, 5):
+                positions[i] += 1
+            for i in range(5):
+                desired[i] += desired_steps[i]
+            for i in range(1, 4):
+                d = desired[i] - positions[i]
+                if d >= 1 and positions[i + 1] - positions[i] > 1:
+                    adjust(i, 1)
+                elif d <= -1 and positions[i - 1] - positions[i] < -1:
+                    adjust(i, -1)
+        def add(values):
+            for value in values:
+                if len(heights) < 5:
+                    heights.append(value)
+                    heights.sort()
+                else:
+                    insert(value)
+        def result():
+            if not heights:
+                return None
+            if positions[4] == 5 and len(heights) <= 5:
+                # every value is still in heights, interpolated between the two around q
+                at = q * (len(heights) - 1)
+                low = math.floor(at)
+                high = min(low + 1, len(heights) - 1)
+                return heights[low] + (heights[high] - heights[low]) * (at - low)
+            return heights[2]
+        return add, result
+    return Aggregator("quantile", create, of)
+
+def register(global_ctx):
+    global_ctx.merge(ctx)
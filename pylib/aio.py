@@ -0,0 +1,35 @@
+import asyncio
+
+from interpreter import Context
+from async_stream import AsyncPipeStream, wait
+
+
+ctx = Context()
+
+async def read_lines(reader):
+    while True:
+        line = await reader.readline()
+        if not line:
+            return
+        yield line.decode()
+
+@ctx.use("process_lines")
+def process_lines(*command):
+    # the lines a subprocess writes to stdout, as it writes them
+    process = wait(asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE))
+    return AsyncPipeStream(read_lines(process.stdout), close=lambda: wait(process.wait()))
+
+@ctx.use("connection_lines")
+def connection_lines(host, port):
+    # the lines read from a tcp connection until the other end closes it
+    reader, writer = wait(asyncio.open_connection(host, port))
+    async def close():
+        writer.close()
+        await writer.wait_closed()
+    return AsyncPipeStream(read_lines(reader), close=lambda: wait(close()))
+
+ctx.set("sleep", asyncio.sleep)
+ctx.set("wait", wait)
+
+def register(global_ctx):
+    global_ctx.merge(ctx)
@@ -1,5 +1,20 @@
 
-from interpreter import Context
+import itertools
+import multiprocessing
+import operator
+import os
+import pickle
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import external_sort
+import hash_partitions
+import numpy_backend
+from interpreter import Context, unset
+from interpreter_definitions import call_function, wrap_as_stream
+from pipe_stream import PipeStream, read_batch
+from window_buffer import WindowBuffer
 
 ctx = Context()
 
@@ -15,24 +30,405 @@ def reduce(start, iter):
         
         this["stop"] = True
         return current
+
+    def reduce_batch(upstream, this, size):
+        if "stop" in this:
+            return []
+
+        current = start
+        while True:
+            values = read_batch(upstream, size)
+            folded = unset
+            if numpy_backend.enabled and (iter is operator.add or iter is operator.mul):
+                folded = numpy_backend.fold(values, iter, current)
+            if folded is not unset:
+                current = folded
+            else:
+                for value in values:
+                    current = iter(value, current)
+            if len(values) < size:
+                break
+
+        this["stop"] = True
+        return [current]
+
+    reducer.batch = reduce_batch
     return reducer
 
-ctx.set("sum", reduce(0, lambda x, t: x + t))
-ctx.set("mult", reduce(1, lambda x, t: x * t))
+# plain operators, so numpy_backend can tell what they do
+ctx.set("sum", reduce(0, operator.add))
+ctx.set("mult", reduce(1, operator.mul))
 
 @ctx.use("window")
 def window(size):
+    # each window is a view of a buffer of the stream that stays as it was, see window_buffer.py
     def window_slide(upstream, this):
-        if "window" not in this:
-            this["window"] = [upstream.next() for x in range(size)]
-            return this["window"]
-        else:
-            window = this["window"]
-            window.pop(0)
-            window.append(upstream.next())
-            return window
+        if "buffer" not in this:
+            this["buffer"] = WindowBuffer(size)
+        views = []
+        while not views:
+            views = this["buffer"].add([upstream.next()])
+        return views[0]
+
+    def window_batch(upstream, this, count):
+        if "buffer" not in this:
+            this["buffer"] = WindowBuffer(size)
+        buffer = this["buffer"]
+        return buffer.add(read_batch(upstream, buffer.missing() + count))
+
+    def window_vector_batch(upstream, this, count):
+        views = window_batch(upstream, this, count)
+        if not views:
+            return views
+        values = views[0].values[views[0].start:views[-1].start + size]
+        windows = numpy_backend.windows(values, size)
+        return views if windows is None else windows
+
+    window_slide.batch = window_batch
+    window_slide.vector_batch = window_vector_batch
     return window_slide
 
+def sliding(create):
+    # a stage of a value for each window over a stream. push = create() takes the values in turn, giving
+    # the value for the window each one ends or unset while there's no window yet
+    def next_value(upstream, this):
+        if "push" not in this:
+            this["push"] = create()
+        push = this["push"]
+        while True:
+            result = push(upstream.next())
+            if result is not unset:
+                return result
+
+    def batch(upstream, this, count):
+        if "push" not in this:
+            this["push"] = create()
+        push = this["push"]
+        results = []
+        while len(results) < count:
+            size = count - len(results)
+            values = read_batch(upstream, size)
+            for value in values:
+                result = push(value)
+                if result is not unset:
+                    results.append(result)
+            if len(values) < size:
+                break
+        return results
+
+    next_value.batch = batch
+    return next_value
+
+def running_sum(size):
+    # taking off the value that leaves the window isn't exact for floats, so every size values the sum is
+    # added up again from the window, which keeps rounding errors from building up and is still O(1) a value
+    def create():
+        values = deque()
+        total = 0
+        since = 0
+        def push(value):
+            nonlocal total, since
+            values.append(value)
+            total = total + value
+            if len(values) > size:
+                total = total - values.popleft()
+            elif len(values) < size:
+                return unset
+            since += 1
+            if since == size:
+                total = sum(values)
+                since = 0
+            return total
+        return push
+    return create
+
+def running_extreme(size, worse):
+    # the values that could still be the min or max of a window, oldest first. a value is dropped once a
+    # later one is better, or as good so ties go to the first like in min and max, and leaves the front
+    # with the window, so each value is added and removed once
+    def create():
+        candidates = deque()
+        index = 0
+        def push(value):
+            nonlocal index
+            while candidates and worse(candidates[-1][1], value):
+                candidates.pop()
+            candidates.append((index, value))
+            if candidates[0][0] <= index - size:
+                candidates.popleft()
+            index += 1
+            return candidates[0][1] if index >= size else unset
+        return push
+    return create
+
+@ctx.use("window_sum")
+def window_sum(size):
+    return sliding(running_sum(size))
+
+@ctx.use("window_mean")
+def window_mean(size):
+    def create():
+        push = running_sum(size)()
+        def mean(value):
+            total = push(value)
+            return unset if total is unset else total / size
+        return mean
+    return sliding(create)
+
+@ctx.use("window_min")
+def window_min(size):
+    return sliding(running_extreme(size, operator.gt))
+
+@ctx.use("window_max")
+def window_max(size):
+    return sliding(running_extreme(size, operator.lt))
+
+# Functions run by parallel, by key. Plum functions close over contexts that can't be pickled, so where
+# processes are forked the pool is only started once the function is in here, and the workers find it
+# here instead of being sent it.
+parallel_functions = {}
+parallel_keys = itertools.count()
+
+def run_parallel_chunk(key, function, data):
+    # the chunk comes and goes pickled, so what can't be pickled is found here and in parallel_map instead
+    # of somewhere in the pool
+    if function is None:
+        function = parallel_functions[key]
+    results = []
+    stopped = False
+    try:
+        for value in pickle.loads(data):
+            results.append(call_function(function, value))
+    except StopIteration:
+        # a break, the stream ends after the results before it
+        stopped = True
+    try:
+        return pickle.dumps(results), stopped
+    except (pickle.PicklingError, TypeError, AttributeError) as e:
+        raise Exception(f"parallel has to send results back from its worker processes, one of them couldn't be "
+                        f"pickled ({e})")
+
+def start_parallel(function, workers):
+    # the pool and the key for function, or the function itself where it has to be pickled
+    key = next(parallel_keys)
+    if "fork" in multiprocessing.get_all_start_methods():
+        if threading.active_count() > 1:
+            # a fork only copies the thread forking, the workers could be left with a lock another one held
+            raise Exception("parallel forks its worker processes, which isn't safe while other threads are "
+                            "running, it can't be used with --threaded or --async")
+        parallel_functions[key] = function
+        pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork"))
+        return pool, key, None
+    try:
+        pickle.dumps(function)
+    except Exception as e:
+        raise Exception(f"parallel can't send {function!r} to its worker processes, they aren't forked here so "
+                        f"it has to be pickled and that failed ({e}). Plum functions can only run in parallel "
+                        f"where processes are forked, python functions have to be defined at the top level "
+                        f"of a module")
+    return ProcessPoolExecutor(workers), key, function
+
+class ParallelRun:
+    # the pool of a parallel stage and the chunks it has in flight. it's closed once the stage ends, raises
+    # or is dropped before it's read to its end, so the workers and the function kept for them go with it
+    def __init__(self, pool, key, function):
+        self.pool = pool
+        self.key = key
+        self.function = function
+        self.pending = deque()
+        self.ready = deque()
+        self.ended = False
+        self.read = False
+
+    def submit(self, values):
+        try:
+            data = pickle.dumps(values)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            raise Exception(f"parallel has to send values to its worker processes, one of them couldn't be "
+                            f"pickled ({e})")
+        self.pending.append(self.pool.submit(run_parallel_chunk, self.key, self.function, data))
+
+    def collect(self):
+        data, stopped = self.pending.popleft().result()
+        self.ready.extend(pickle.loads(data))
+        if stopped:
+            self.close()
+
+    def close(self, wait=True):
+        # the chunks still in flight are dropped. waiting for the workers to go also ends the pool's own
+        # threads, so the next parallel can still fork
+        if self.ended:
+            return
+        self.ended = True
+        self.pending.clear()
+        self.pool.shutdown(wait=wait, cancel_futures=True)
+        parallel_functions.pop(self.key, None)
+
+    def __del__(self):
+        self.close(False)
+
+@ctx.use("parallel")
+def parallel(function, workers=None, chunk=256):
+    # a map running function in worker processes, chunk values at a time, with at most two chunks per
+    # worker in flight. values come out in order. function should be pure, anything it changes is only
+    # changed in the worker it ran in
+    workers = workers or os.cpu_count() or 1
+
+    def parallel_map(upstream, this):
+        if "run" not in this:
+            this["run"] = ParallelRun(*start_parallel(function, workers))
+        run = this["run"]
+        try:
+            while not run.ready:
+                while not run.read and not run.ended and len(run.pending) < workers * 2:
+                    values = read_batch(upstream, chunk)
+                    run.read = len(values) < chunk
+                    if values:
+                        run.submit(values)
+                if not run.pending:
+                    run.close()
+                    raise StopIteration
+                run.collect()
+        except BaseException:
+            run.close()
+            raise
+        return run.ready.popleft()
+
+    return parallel_map
+
+@ctx.use("tee")
+def tee(stream, count=2, memory_limit=None):
+    # a list of count streams each reading all of stream, so it's only read once for all of them
+    return wrap_as_stream(stream).tee(count, memory_limit)
+
+def keyed(upstream, key):
+    # (key(value), value) for each value of upstream, or (value, value) without key, read a batch at a time
+    while True:
+        values = read_batch(upstream, external_sort.block_size)
+        for value in values:
+            yield (value if key is None else call_function(key, value)), value
+        if len(values) < external_sort.block_size:
+            return
+
+def emitting(start):
+    # a stage giving the values of the iterator start(upstream), which is only made once it's first read
+    def executor(upstream, this):
+        if "values" not in this:
+            this["values"] = start(upstream)
+        return next(this["values"])
+
+    def batch(upstream, this, size):
+        if "values" not in this:
+            this["values"] = start(upstream)
+        return list(itertools.islice(this["values"], size))
+
+    executor.batch = batch
+    return executor
+
+@ctx.use("sort")
+def sort(key=None, reverse=False):
+    # the values ordered by key(value), or by themselves, equal ones in the order they came in. past
+    # external_sort.memory_limit values they're sorted in runs on disk, see external_sort.py
+    def start(upstream):
+        return map(operator.itemgetter(1), external_sort.sort_pairs(keyed(upstream, key), reverse))
+    return emitting(start)
+
+@ctx.use("group_by")
+def group_by(key, reducer=None):
+    # (key, result) for each key in order, result being the last value reducer, a stage like sum or
+    # aggregate(...), gives over the values with that key, or a list of them without reducer
+    def start(upstream):
+        pairs = external_sort.sort_pairs(keyed(upstream, key))
+        for group_key, group in itertools.groupby(pairs, key=operator.itemgetter(0)):
+            values = map(operator.itemgetter(1), group)
+            if reducer is None:
+                yield group_key, list(values)
+                continue
+            stream = PipeStream(PipeStream(values), reducer)
+            result = None
+            while True:
+                results = stream.next_batch(external_sort.block_size)
+                if results:
+                    result = results[-1]
+                if len(results) < external_sort.block_size:
+                    break
+            yield group_key, result
+    return emitting(start)
+
+@ctx.use("distinct")
+def distinct(key=None):
+    # the first value with each key, in the order they came in. the keys are kept in a set as values go by,
+    # past external_sort.memory_limit of them the rest of the stream is sorted by key on disk to find the
+    # first of each key left, which are then sorted back into the order they came in
+    def start(upstream):
+        seen = set()
+        pairs = keyed(upstream, key)
+        for value_key, value in pairs:
+            if value_key not in seen:
+                seen.add(value_key)
+                yield value
+                if len(seen) >= external_sort.memory_limit:
+                    break
+        rest = ((value_key, (index, value)) for index, (value_key, value) in enumerate(pairs)
+                if value_key not in seen)
+        firsts = (next(group)[1] for _, group in
+                  itertools.groupby(external_sort.sort_pairs(rest), key=operator.itemgetter(0)))
+        for _, value in external_sort.sort_pairs(firsts):
+            yield value
+    return emitting(start)
+
+@ctx.use("index_by")
+def index_by(stream, key=None, unique=False):
+    # a dict of key(row) to the list of rows of stream with that key, or with unique to the only one.
+    # stream is read once. past external_sort.memory_limit rows they're partitioned to disk instead, and
+    # the index is one only join can use, see hash_partitions.py
+    rows = {}
+    count = 0
+    partitions = None
+    for row_key, row in keyed(wrap_as_stream(stream), key):
+        if partitions is not None:
+            partitions.add(row_key, row)
+            continue
+        hash_partitions.add_row(rows, row_key, row, unique)
+        count += 1
+        if count > external_sort.memory_limit:
+            partitions = hash_partitions.Partitions()
+            for row_key, kept in rows.items():
+                for row in [kept] if unique else kept:
+                    partitions.add(row_key, row)
+            rows = None
+    return rows if partitions is None else hash_partitions.SpilledIndex(partitions, unique)
+
+@ctx.use("join")
+def join(index, key=None):
+    # (value, what index has for key(value)) for each value, None where it has nothing. a dict is looked up
+    # as values go by, an index partitioned to disk is joined a partition at a time once the whole stream
+    # has been partitioned the same way, so the values come out grouped by partition
+    if isinstance(index, hash_partitions.SpilledIndex):
+        def start(upstream):
+            partitions = hash_partitions.Partitions()
+            for value_key, value in keyed(upstream, key):
+                partitions.add(value_key, value)
+            for partition in range(hash_partitions.partition_count):
+                rows = index.load(partition)
+                for value_key, value in partitions.read(partition):
+                    yield value, rows.get(value_key)
+            partitions.close()
+        return emitting(start)
+
+    def joiner(upstream, this):
+        value = upstream.next()
+        return value, index.get(value if key is None else call_function(key, value))
+
+    def join_batch(upstream, this, size):
+        values = read_batch(upstream, size)
+        if key is None:
+            return [(value, index.get(value)) for value in values]
+        return [(value, index.get(call_function(key, value))) for value in values]
+
+    joiner.batch = join_batch
+    return joiner
+
 ctx.set("range", range)
 
 def register(global_ctx):
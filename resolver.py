@@ -0,0 +1,141 @@
+from node import Node
+
+# Every scope here lines up with exactly one context at runtime: a function scope with the Frame
+# created for each call, a flow scope with the inner context a flow evaluates its target in, and
+# the top scope with the context the program is run in. So the number of scopes between a variable
+# and where it is declared is the number of parents to walk at runtime.
+
+class Scope:
+    def __init__(self, kind, parent=None):
+        self.kind = kind
+        self.parent = parent
+        # function scopes keep their variables in frame slots, the others in context dicts
+        self.slots = {}
+        self.names = set()
+
+    def declare(self, name):
+        if self.kind == "function":
+            if name not in self.slots:
+                self.slots[name] = len(self.slots)
+        else:
+            self.names.add(name)
+
+    def get_outer(self):
+        scope = self
+        while scope.kind == "flow":
+            scope = scope.parent
+        return scope
+
+class Resolution:
+    def __init__(self):
+        # variable, for and write flow nodes -> where their variable lives
+        self.addresses = {}
+        # function nodes -> (frame size, argument slots)
+        self.frames = {}
+
+class Resolver:
+    def __init__(self):
+        self.resolution = Resolution()
+        self.reads = []
+        self.writes = []
+        self.functions = []
+
+    def resolve(self, nodes):
+        top = Scope("top")
+        for node in nodes:
+            self.walk(node, top)
+        # scopes are only complete once everything is walked, a read may come before the assignment it sees
+        for node, scope in self.reads:
+            self.resolution.addresses[node] = read_address(node.name, scope)
+        for node, name, scope, target in self.writes:
+            self.resolution.addresses[node] = write_address(name, scope, target)
+        for node, scope, slots in self.functions:
+            self.resolution.frames[node] = (len(scope.slots), slots)
+        return self.resolution
+
+    def walk(self, value, scope):
+        if isinstance(value, Node):
+            walker = getattr(self, f"walk_{value.type}", None)
+            if walker is not None:
+                walker(value, scope)
+            else:
+                for field in value.fields:
+                    self.walk(getattr(value, field, None), scope)
+        elif isinstance(value, (list, tuple)):
+            for v in value:
+                self.walk(v, scope)
+
+    def walk_variable(self, node, scope):
+        self.reads.append((node, scope))
+
+    def walk_assign(self, node, scope):
+        if node.location.type == "variable":
+            scope.declare(node.location.name)
+            self.writes.append((node.location, node.location.name, scope, scope))
+        else:
+            self.walk(node.location, scope)
+        self.walk(node.value, scope)
+
+    def walk_for(self, node, scope):
+        scope.declare(node.variable)
+        self.writes.append((node, node.variable, scope, scope))
+        self.walk(node.iterable, scope)
+        self.walk(node.body, scope)
+
+    def walk_function(self, node, scope):
+        function_scope = Scope("function", scope)
+        slots = declare_arguments(function_scope, node.arguments)
+        self.walk(node.body, function_scope)
+        self.functions.append((node, function_scope, slots))
+
+    def walk_flow(self, node, scope):
+        self.walk(node.flow_from, scope)
+        flow_to = node.flow_to
+        if node.flow_type in ["pipe", "map", "read"]:
+            self.walk(flow_to, Scope("flow", scope.get_outer()))
+        elif node.flow_type == "write":
+            # written into the outer context, a property access target is evaluated there too
+            outer = scope.get_outer()
+            if flow_to.type == "variable":
+                outer.declare(flow_to.name)
+                self.writes.append((flow_to, flow_to.name, scope, outer))
+            elif flow_to.type == "property_access":
+                self.walk(flow_to.target, outer)
+
+def declare_arguments(scope, arguments):
+    slots = []
+    for argument in arguments:
+        if isinstance(argument, list):
+            slots.append(declare_arguments(scope, argument))
+        else:
+            scope.declare(argument)
+            slots.append(scope.slots[argument])
+    return slots
+
+def read_address(name, scope):
+    # every candidate may still be unset at runtime (a conditional assignment, a missing argument),
+    # in which case the lookup falls through to the next one, the last always being the top scope
+    address = []
+    hops = 0
+    while scope.kind != "top":
+        if scope.kind == "function" and name in scope.slots:
+            address.append(("slot", hops, scope.slots[name]))
+        elif scope.kind == "flow" and name in scope.names:
+            address.append(("dict", hops, None))
+        scope = scope.parent
+        hops += 1
+    address.append(("global", hops, None))
+    return address
+
+def write_address(name, scope, target):
+    hops = 0
+    while scope is not target:
+        scope = scope.parent
+        hops += 1
+    if target.kind == "function":
+        return ("slot", hops, target.slots[name])
+    else:
+        return ("dict", hops, None)
+
+def resolve(nodes):
+    return Resolver().resolve(nodes)
@@ -1,58 +1,134 @@
+import re
+from operator import itemgetter
 
 class Token:
-    def __init__(self, type, content, flags):
+    def __init__(self, type, content, flags, start=None, end=None, line=None, column=None):
         self.type = type
         self.content = content
         self.flags = flags
+        self.start = start
+        self.end = end
+        self.line = line
+        self.column = column
 
 class TokenDefinition:
-    def __init__(self, name, processor, flags=None):
+    def __init__(self, name, processor, flags=None, pattern=None):
         self.name = name
         self.processor = processor
         self.flags = flags or {}
+        # regex matching exactly what processor accepts, lets the tokenizer fold this definition into its master regex
+        self.pattern = pattern
 
 class Tokenizer:
     def __init__(self):
         self.definitions = []
+        self.compiled = False
+        self.master = None
+        self.select = None
 
     def define(self, defn):
         self.definitions.append(defn)
+        self.master = None
 
-    def read(self, string):
-        best_length, best_defn = 0, None
-        for defn in self.definitions:
-            length = defn.processor(string)
-            if length > best_length:
+    def compile(self):
+        self.compiled = True
+        self.master = None
+        return self
+
+    def _build_master(self):
+        # every pattern gets an optional lookahead group, so a single match at the cursor
+        # reports the length each definition would have matched on its own
+        parts, groups = [], []
+        self.pattern_definitions, self.processor_definitions = [], []
+        self.order = {}
+        for i, defn in enumerate(self.definitions):
+            self.order[defn] = i
+            if defn.pattern is None:
+                self.processor_definitions.append(defn)
+            else:
+                parts.append(f"(?:(?=(?P<d{i}>{defn.pattern}))|)")
+                self.pattern_definitions.append(defn)
+                groups.append(f"d{i}")
+        self.master = re.compile("".join(parts))
+        # patterns may carry their own groups, so pick ours out of match.groups()
+        positions = [self.master.groupindex[group] - 1 for group in groups]
+        if not positions:
+            self.select = lambda matched: ()
+        elif len(positions) == 1:
+            self.select = lambda matched: (matched[positions[0]],)
+        else:
+            self.select = itemgetter(*positions)
+
+    def _read_compiled(self, string, position):
+        if self.master is None:
+            self._build_master()
+        lengths = list(map(len, self.select(self.master.match(string, position).groups(""))))
+        best_length = max(lengths, default=0)
+        # index() finds the earliest definition among those tied for the longest match
+        best_defn = self.pattern_definitions[lengths.index(best_length)] if best_length else None
+        for defn in self.processor_definitions:
+            length = defn.processor(string, position)
+            if length > best_length or (length and length == best_length and self.order[defn] < self.order[best_defn]):
                 best_length, best_defn = length, defn
+        return best_length, best_defn
+
+    def read(self, string, position=0):
+        if self.compiled:
+            best_length, best_defn = self._read_compiled(string, position)
+        else:
+            best_length, best_defn = 0, None
+            for defn in self.definitions:
+                length = defn.processor(string, position)
+                if length > best_length:
+                    best_length, best_defn = length, defn
         
         if best_defn is None:
-            return None, string
+            return None, position
         else:
-            return Token(best_defn.name, string[:best_length], best_defn.flags.copy()), string[best_length:]
+            end = position + best_length
+            return Token(best_defn.name, string[position:end], best_defn.flags.copy(), start=position, end=end), end
 
 
 class TokenStream:
-    def __init__(self, tokenizer, string, tokens=None, index=0):
+    def __init__(self, tokenizer, string, tokens=None, index=0, position=0, line=1, column=1):
         self.tokenizer = tokenizer
-        self.string = string
+        # the source is never sliced, tokens are read at an offset into it
+        self.source = string
+        self.position = position
+        self.line = line
+        self.column = column
         self.tokens = tokens if tokens is not None else []
         self.index = index or 0
 
+    @property
+    def string(self):
+        return self.source[self.position:]
+
     def copy(self):
-        return TokenStream(self.tokenizer, self.string, self.tokens, self.index)
+        return TokenStream(self.tokenizer, self.source, self.tokens, self.index, self.position, self.line, self.column)
 
     def merge(self, stream):
         self.index = stream.index
 
+    def advance(self, end):
+        newlines = self.source.count("\n", self.position, end)
+        if newlines:
+            self.line += newlines
+            self.column = end - self.source.rfind("\n", self.position, end)
+        else:
+            self.column += end - self.position
+        self.position = end
+
     def read(self, index):
         while len(self.tokens) <= index:
-            token, string = self.tokenizer.read(self.string)
+            token, end = self.tokenizer.read(self.source, self.position)
             if token is None:
                 return None
             
+            token.line, token.column = self.line, self.column
             if not token.flags.get("throwaway", False):
                 self.tokens.append(token)
-            self.string = string
+            self.advance(end)
         return self.tokens[index]
 
     def next(self):
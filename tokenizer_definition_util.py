@@ -2,30 +2,43 @@ import re
 from tokenizer import TokenDefinition
 
 def regex(name, expr, **flags):
-    compiled = re.compile(expr)
-    def processor(string):
-        result = compiled.search(string)
-        if result:
-            return result.span(0)[1]
-        return 0
-    return TokenDefinition(name, processor, flags)
+    if expr.startswith("^"):
+        # anchored expressions match at the cursor rather than at the start of the source
+        pattern = expr[1:]
+        compiled = re.compile(pattern)
+        def processor(string, position):
+            result = compiled.match(string, position)
+            if result:
+                return result.end() - position
+            return 0
+    else:
+        pattern = None
+        compiled = re.compile(expr)
+        def processor(string, position):
+            result = compiled.search(string, position)
+            if result:
+                return result.end() - position
+            return 0
+    # only start-anchored expressions can be folded into the tokenizer's master regex
+    return TokenDefinition(name, processor, flags, pattern=pattern)
 
 def word(name, word, **flags):
     length = len(word)
-    def processor(string):
-        if string.startswith(word):
+    def processor(string, position):
+        if string.startswith(word, position):
             return length
         else:
             return 0
-    return TokenDefinition(name, processor, flags)
+    return TokenDefinition(name, processor, flags, pattern=re.escape(word))
 
 def wordlist(name, words, **flags):
-    def processor(string):
+    def processor(string, position):
         best_length = 0
         for word in words:
-            if len(word) > best_length and string.startswith(word):
+            if len(word) > best_length and string.startswith(word, position):
                 best_length = len(word)
         return best_length
-    return TokenDefinition(name, processor, flags)
-
+    # longest words first, so the regex alternation picks the longest match like processor does
+    pattern = "|".join(re.escape(word) for word in sorted(words, key=len, reverse=True) if word)
+    return TokenDefinition(name, processor, flags, pattern=pattern or None)
 
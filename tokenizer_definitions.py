@@ -35,3 +35,4 @@ tokenizer.define(regex("whitespace", r"^[ \t\r]+", throwaway=True))
 tokenizer.define(wordlist("whitebreak", ["\n", ";"]))
 tokenizer.define(regex("string", r"^\"(?:[^\"\\]|\\.)*\""))
 tokenizer.define(regex("string", r"^'(?:[^'\\]|\\.)*'"))
+tokenizer.compile()
@@ -0,0 +1,334 @@
+from interpreter import Frame, unset
+from interpreter_definitions import get_property, set_property, call_function, bind_arguments, bind_slots, ancestor
+
+# Instructions are (opcode, argument) pairs, opcodes are plain strings like node types are.
+#
+# The vm is a stack machine whose stack doesn't move: while lowering, every value on the stack is given
+# the register at its depth, so instructions name the registers they read and write instead of pushing
+# and popping. In function code the registers are the slots of the call's Frame, the variables first and
+# the stack after them, so reading a variable is reading its register. Everywhere else the variables are
+# in context dicts and the registers are just the stack.
+#
+# What each instruction does, d is the register written, s, a, b and t registers read:
+#
+#   const               (d, value)                  d = value
+#   move                (d, s)                      d = s
+#   load_name           (d, name)                   d = ctx.get(name)
+#   load_global         (d, name, hops)             d = the parent hops up .get(name)
+#   load_lookup         (d, lookup)                 d = lookup(ctx), for addresses that walk up the contexts
+#   load_this           d                           d = ctx.this
+#   store_name          (name, s)                   ctx.set(name, s), on a context with a dict
+#   store_setter        (setter, s)                 setter(ctx, s)
+#   get_property        (d, s, name)                d = property of s
+#   get_this_property   (d, name)                   d = property of ctx.this
+#   set_property        (d, t, name, s)             d = s, setting the property of t
+#   index               (d, t, s)                   d = t[s]
+#   call                (d, function, arguments)    d = function(arguments), calls to plum functions are run
+#                                                   by this loop, not by a new one
+#   binary              (operator, d, a, b)         d = operator(a, b)
+#   binary_const        (operator, d, a, constant)  d = operator(a, constant)
+#   negate              (d, s)                      d = -s
+#   jump                target
+#   jump_if_false       (target, s)
+#   jump_unless         (target, operator, a, b)    jump when operator(a, b) doesn't hold
+#   jump_unless_const   (target, operator, a, c)    jump when operator(a, constant) doesn't hold
+#   jump_if_not_none    (target, s)
+#   build_list          (d, first, count)           d = the count registers from first as a list
+#   build_tuple         (d, first, count)           same, as a tuple
+#   make_function       (d, code, layout, args)     d = a function closing over the current context
+#   get_iter            (d, s)                      d = iter(s)
+#   for_next            (target, s, d)              d = next(s) and jump to target, unless s is exhausted
+#   flow                (run flow, d, s, flow_to)   d = a flow from s, see the run_*_flow functions
+#   break                                           raise StopIteration, ending the stream it's in
+#   return              s
+#
+# A variable's register is unset until it's assigned, reading one then looks the variable up in the
+# enclosing contexts instead, through the fallback the code has for that register.
+
+class Code:
+    def __init__(self, name, base=0):
+        self.name = name
+        self.instructions = []
+        # registers below base hold variables, the stack starts at base
+        self.base = base
+        self.registers = base
+        # register -> lookup of its variable in the enclosing contexts, for when it's still unset
+        self.fallbacks = {}
+
+    def emit(self, op, arg=None):
+        self.instructions.append((op, arg))
+        return len(self.instructions) - 1
+
+    def patch(self, index):
+        # points the jump at index to the next instruction emitted, it's always the first of its argument
+        op, arg = self.instructions[index]
+        target = len(self.instructions)
+        self.instructions[index] = (op, (target,) + arg[1:] if isinstance(arg, tuple) else target)
+
+    def reserve(self, register):
+        if register >= self.registers:
+            self.registers = register + 1
+
+    def __str__(self):
+        lines = [f"{self.name}: {self.registers} registers, stack from {self.base}"]
+        for i, (op, arg) in enumerate(self.instructions):
+            lines.append(f"  {i:4} {op:<18} {'' if arg is None else repr(arg)}")
+        return "\n".join(lines)
+
+class BytecodeCompiler:
+    def __init__(self, lowerers=None, statement_lowerers=None, resolution=None):
+        self.lowerers = lowerers if lowerers is not None else {}
+        # lowerers for nodes whose value is thrown away, which can often skip computing it
+        self.statement_lowerers = statement_lowerers if statement_lowerers is not None else {}
+        self.resolution = resolution
+
+    def copy(self, resolution=None):
+        return BytecodeCompiler(lowerers=self.lowerers, statement_lowerers=self.statement_lowerers, resolution=resolution)
+
+    def address(self, node):
+        if self.resolution is not None:
+            return self.resolution.addresses.get(node)
+
+    def frame(self, node):
+        if self.resolution is not None:
+            return self.resolution.frames.get(node)
+
+    def lowerer(self, name):
+        def decorator(func):
+            self.lowerers[name] = func
+            return func
+        return decorator
+
+    def statement_lowerer(self, name):
+        def decorator(func):
+            self.statement_lowerers[name] = func
+            return func
+        return decorator
+
+    def lower(self, node, code, d):
+        # leaves the value of node in register d, using the registers after it as its stack
+        code.reserve(d)
+        if node.type in self.lowerers:
+            self.lowerers[node.type](self, node, code, d)
+        else:
+            raise Exception(f"No lowerer defined for node type {node.type}")
+
+    def lower_statement(self, node, code, d):
+        if node.type in self.statement_lowerers:
+            code.reserve(d)
+            self.statement_lowerers[node.type](self, node, code, d)
+        else:
+            self.lower(node, code, d)
+
+    def lower_all(self, nodes, code, d, discard_last=False):
+        if not nodes:
+            code.emit("const", (d, None))
+        for i, node in enumerate(nodes):
+            if i < len(nodes) - 1:
+                self.lower_statement(node, code, d)
+            elif discard_last:
+                self.lower_statement(node, code, d)
+                code.emit("const", (d, None))
+            else:
+                self.lower(node, code, d)
+
+    def compile(self, node, name, base=0):
+        code = Code(name, base)
+        self.lower(node, code, base)
+        code.emit("return", base)
+        return code
+
+    def compile_all(self, nodes, name="main", discard_last=False):
+        code = Code(name)
+        self.lower_all(nodes, code, 0, discard_last)
+        code.emit("return", 0)
+        return code
+
+class VMFunction:
+    def __init__(self, code, ctx, layout, arguments):
+        self.code = code
+        self.ctx = ctx
+        self.layout = layout
+        self.arguments = arguments
+
+    def activate(self, values):
+        # the context and registers of a call
+        if self.layout is None:
+            ctx = self.ctx.branch()
+            bind_arguments(ctx, values, self.arguments)
+            return ctx, [None] * self.code.registers
+        argument_slots, count, _ = self.layout
+        if count is not None:
+            # plain distinct arguments take the first slots in order
+            slots = list(values[:count])
+            slots.extend([unset] * (self.code.registers - len(slots)))
+        else:
+            slots = [unset] * self.code.registers
+            bind_slots(slots, values, argument_slots)
+        return Frame(self.ctx, slots), slots
+
+    def __call__(self, *values):
+        ctx, registers = self.activate(values)
+        return execute(self.code, ctx, registers)
+
+def execute(code, ctx, r=None):
+    # calls between plum functions don't recurse into execute, the caller is saved on calls and
+    # resumed on return, only calls coming from python (pylib, streams) start a new loop
+    if r is None:
+        r = [None] * code.registers
+    calls = []
+    instructions = code.instructions
+    fallbacks = code.fallbacks
+    pc = 0
+    # roughly ordered by how often they run
+    while True:
+        op, arg = instructions[pc]
+        pc += 1
+        if op == "binary_const":
+            operator, d, a, constant = arg
+            left = r[a]
+            if left is unset:
+                left = fallbacks[a](ctx)
+            r[d] = operator(left, constant)
+        elif op == "binary":
+            operator, d, a, b = arg
+            left = r[a]
+            if left is unset:
+                left = fallbacks[a](ctx)
+            right = r[b]
+            if right is unset:
+                right = fallbacks[b](ctx)
+            r[d] = operator(left, right)
+        elif op == "for_next":
+            try:
+                r[arg[2]] = next(r[arg[1]])
+                pc = arg[0]
+            except StopIteration:
+                pass
+        elif op == "jump_unless_const":
+            target, operator, a, constant = arg
+            left = r[a]
+            if left is unset:
+                left = fallbacks[a](ctx)
+            if not operator(left, constant):
+                pc = target
+        elif op == "jump_unless":
+            target, operator, a, b = arg
+            left = r[a]
+            if left is unset:
+                left = fallbacks[a](ctx)
+            right = r[b]
+            if right is unset:
+                right = fallbacks[b](ctx)
+            if not operator(left, right):
+                pc = target
+        elif op == "jump":
+            pc = arg
+        elif op == "jump_if_false":
+            value = r[arg[1]]
+            if value is unset:
+                value = fallbacks[arg[1]](ctx)
+            if not value:
+                pc = arg[0]
+        elif op == "load_name":
+            # only ever run against a context with a dict, mostly finding the name right there
+            variables = ctx.variables
+            r[arg[0]] = variables[arg[1]] if arg[1] in variables else ctx.get(arg[1])
+        elif op == "store_name":
+            ctx.variables[arg[0]] = r[arg[1]]
+        elif op == "load_global":
+            d, name, hops = arg
+            scope = ctx.parent if hops == 1 else ancestor(ctx, hops)
+            variables = scope.variables
+            r[d] = variables[name] if name in variables else scope.get(name)
+        elif op == "move":
+            value = r[arg[1]]
+            r[arg[0]] = fallbacks[arg[1]](ctx) if value is unset else value
+        elif op == "const":
+            r[arg[0]] = arg[1]
+        elif op == "call":
+            d, f, a = arg
+            function = r[f]
+            if function is unset:
+                function = fallbacks[f](ctx)
+            args = r[a]
+            if args is unset:
+                args = fallbacks[a](ctx)
+            if type(function) is VMFunction:
+                calls.append((code, pc, r, ctx, d))
+                values = args if isinstance(args, tuple) else (args,)
+                layout = function.layout
+                if layout is not None and len(values) == layout[1]:
+                    # the usual call, every argument given to a function taking plain ones
+                    r = [*values, *layout[2]]
+                    ctx = Frame(function.ctx, r)
+                else:
+                    ctx, r = function.activate(values)
+                code = function.code
+                instructions = code.instructions
+                fallbacks = code.fallbacks
+                pc = 0
+            else:
+                r[d] = call_function(function, args)
+        elif op == "return":
+            value = r[arg]
+            if value is unset:
+                value = fallbacks[arg](ctx)
+            if not calls:
+                return value
+            code, pc, r, ctx, d = calls.pop()
+            instructions = code.instructions
+            fallbacks = code.fallbacks
+            r[d] = value
+        elif op == "load_lookup":
+            r[arg[0]] = arg[1](ctx)
+        elif op == "jump_if_not_none":
+            if r[arg[1]] is not None:
+                pc = arg[0]
+        elif op == "get_property":
+            d, s, name = arg
+            value = r[s]
+            if value is unset:
+                value = fallbacks[s](ctx)
+            r[d] = get_property(value, name)
+        elif op == "get_this_property":
+            r[arg[0]] = get_property(ctx.this, arg[1])
+        elif op == "index":
+            d, t, s = arg
+            target = r[t]
+            if target is unset:
+                target = fallbacks[t](ctx)
+            index = r[s]
+            if index is unset:
+                index = fallbacks[s](ctx)
+            r[d] = get_property(target, index)
+        elif op == "store_setter":
+            arg[0](ctx, r[arg[1]])
+        elif op == "load_this":
+            r[arg] = ctx.this
+        elif op == "set_property":
+            d, t, name, s = arg
+            r[d] = set_property(r[t], name, r[s])
+        elif op == "negate":
+            value = r[arg[1]]
+            if value is unset:
+                value = fallbacks[arg[1]](ctx)
+            r[arg[0]] = -value
+        elif op == "build_list":
+            d, first, count = arg
+            r[d] = r[first:first + count]
+        elif op == "build_tuple":
+            d, first, count = arg
+            r[d] = tuple(r[first:first + count])
+        elif op == "make_function":
+            d, function_code, layout, arguments = arg
+            r[d] = VMFunction(function_code, ctx, layout, arguments)
+        elif op == "get_iter":
+            r[arg[0]] = iter(r[arg[1]])
+        elif op == "flow":
+            run_flow, d, s, flow_to = arg
+            r[d] = run_flow(ctx, r[s], flow_to)
+        elif op == "break":
+            raise StopIteration()
+        else:
+            raise Exception(f"unknown opcode {op}")
@@ -0,0 +1,328 @@
+from vm import BytecodeCompiler, execute
+from interpreter import unset
+from interpreter_definitions import (create_lookup, create_setter, create_write_setter, run_pipe_flow, run_map_flow,
+                                     run_write_flow, run_read_flow, run_discarded_read_flow, run_pop_flow, reads_alone)
+from pipe_stream import thread_stage, stream_mark
+from node import Node
+from optimizer import folders, is_literal
+
+bytecode_compiler = BytecodeCompiler()
+
+pure_types = ["variable", "int", "float", "string", "boolean", "binary_operator", "negative", "wrapped"]
+
+def is_pure(node):
+    # evaluating it can't assign anything, so a variable read before it can be read after it instead
+    if node.type not in pure_types:
+        return False
+    return all(is_pure(getattr(node, field)) for field in ["left", "right", "value"]
+               if isinstance(getattr(node, field, None), Node))
+
+def local_slot(compiler, node, code):
+    # the register of a variable of the current frame, if that's where it's looked for first
+    if node.type != "variable":
+        return None
+    address = compiler.address(node)
+    if address is None or address[0][0] != "slot" or address[0][1] != 0:
+        return None
+    slot = address[0][2]
+    if slot not in code.fallbacks:
+        code.fallbacks[slot] = create_lookup(node.name, address[1:])
+    return slot
+
+def operand(compiler, node, code, d):
+    # the register holding the value of node, a variable of the current frame is read where it is
+    slot = local_slot(compiler, node, code)
+    if slot is not None:
+        return slot
+    compiler.lower(node, code, d)
+    return d
+
+def create_executor(code):
+    # flow targets are evaluated in a context of their own, so they get their own code
+    return lambda ctx: execute(code, ctx)
+
+def pop_flow(ctx, from_value, _):
+    return run_pop_flow(from_value)
+
+def threaded_flow(run_flow):
+    # the flow with its source run on a thread of its own when it can be, see reads_alone. the source comes
+    # as a tuple of the stream_mark taken before it ran and its value
+    def run(ctx, marked, flow_to):
+        mark, from_value = marked
+        return run_flow(ctx, thread_stage(from_value, mark), flow_to)
+    return run
+
+def take_mark(ctx):
+    return stream_mark()
+
+@bytecode_compiler.lowerer("variable")
+def lower_variable(compiler, node, code, d):
+    address = compiler.address(node)
+    slot = local_slot(compiler, node, code)
+    if slot is not None:
+        code.emit("move", (d, slot))
+    elif address is None or address == [("global", 0, None)]:
+        code.emit("load_name", (d, node.name))
+    elif len(address) == 1:
+        code.emit("load_global", (d, node.name, address[0][1]))
+    else:
+        code.emit("load_lookup", (d, create_lookup(node.name, address)))
+
+@bytecode_compiler.lowerer("property")
+def lower_property(compiler, node, code, d):
+    code.emit("get_this_property", (d, node.name))
+
+@bytecode_compiler.lowerer("property_access")
+def lower_property_access(compiler, node, code, d):
+    code.emit("get_property", (d, operand(compiler, node.target, code, d), node.name))
+
+def emit_store(compiler, code, location, name, s):
+    address = compiler.address(location)
+    if address is None or address == ("dict", 0, None):
+        code.emit("store_name", (name, s))
+    elif address[0] == "slot" and address[1] == 0:
+        code.emit("move", (address[2], s))
+    else:
+        code.emit("store_setter", (create_setter(name, address), s))
+
+@bytecode_compiler.lowerer("assign")
+def lower_assign(compiler, node, code, d):
+    location = node.location
+    if location.type == "variable":
+        compiler.lower(node.value, code, d)
+        emit_store(compiler, code, location, location.name, d)
+    elif location.type == "property":
+        code.emit("load_this", d)
+        compiler.lower(node.value, code, d + 1)
+        code.emit("set_property", (d, d, location.name, d + 1))
+    elif location.type == "property_access":
+        compiler.lower(location.target, code, d)
+        compiler.lower(node.value, code, d + 1)
+        code.emit("set_property", (d, d, location.name, d + 1))
+    else:
+        raise Exception(f"cannot assign {location.type} to a value, must be a variable or property")
+
+@bytecode_compiler.statement_lowerer("assign")
+def lower_assign_statement(compiler, node, code, d):
+    # nothing reads the value, so it can be written straight into the variable's register
+    location = node.location
+    address = compiler.address(location) if location.type == "variable" else None
+    if address is None or address[0] != "slot" or address[1] != 0:
+        lower_assign(compiler, node, code, d)
+    elif node.value.type == "binary_operator" and node.value.operator in folders:
+        lower_binary(compiler, node.value, code, d, address[2])
+    elif is_literal(node.value):
+        code.emit("const", (address[2], node.value.value))
+    else:
+        lower_assign(compiler, node, code, d)
+
+@bytecode_compiler.lowerer("function_call")
+def lower_function_call(compiler, node, code, d):
+    if is_pure(node.args):
+        function = operand(compiler, node.target, code, d)
+    else:
+        function = d
+        compiler.lower(node.target, code, d)
+    code.emit("call", (d, function, operand(compiler, node.args, code, d + 1)))
+
+def lower_operands(compiler, node, code, d):
+    # the registers of both operands, the right one may be a constant instead, operands that need
+    # computing go from d
+    left = local_slot(compiler, node.left, code) if is_pure(node.right) else None
+    if left is None:
+        left = d
+        compiler.lower(node.left, code, d)
+    if is_literal(node.right):
+        return left, None, node.right.value
+    return left, operand(compiler, node.right, code, d + 1 if left == d else d), None
+
+def lower_binary(compiler, node, code, d, destination):
+    # destination is where the result goes
+    operator = folders[node.operator]
+    left, right, constant = lower_operands(compiler, node, code, d)
+    if right is None:
+        code.emit("binary_const", (operator, destination, left, constant))
+    else:
+        code.emit("binary", (operator, destination, left, right))
+
+def lower_condition(compiler, condition, code, d):
+    # the jump taken when condition doesn't hold, for the caller to patch
+    if condition.type == "binary_operator" and condition.operator in folders:
+        operator = folders[condition.operator]
+        left, right, constant = lower_operands(compiler, condition, code, d)
+        if right is None:
+            return code.emit("jump_unless_const", (None, operator, left, constant))
+        return code.emit("jump_unless", (None, operator, left, right))
+    return code.emit("jump_if_false", (None, operand(compiler, condition, code, d)))
+
+@bytecode_compiler.lowerer("binary_operator")
+def lower_binary_operator(compiler, node, code, d):
+    if node.operator == "??":
+        compiler.lower(node.left, code, d)
+        jump = code.emit("jump_if_not_none", (None, d))
+        compiler.lower(node.right, code, d)
+        code.patch(jump)
+    elif node.operator in folders:
+        lower_binary(compiler, node, code, d, d)
+    else:
+        raise Exception(f"unknown operator {node.operator}")
+
+@bytecode_compiler.lowerer("flow")
+def lower_flow(compiler, node, code, d, discarded=False):
+    flow_type = node.flow_type
+    threaded = reads_alone(node.flow_from)
+    if threaded:
+        code.emit("load_lookup", (d, take_mark))
+        compiler.lower(node.flow_from, code, d + 1)
+        code.emit("build_tuple", (d, d, 2))
+    else:
+        compiler.lower(node.flow_from, code, d)
+    if flow_type in ["pipe", "map", "read"]:
+        run_flow = {"pipe": run_pipe_flow, "map": run_map_flow, "read": run_read_flow}[flow_type]
+        if flow_type == "read" and discarded:
+            run_flow = run_discarded_read_flow
+        flow_to = create_executor(compiler.compile(node.flow_to, f"{flow_type} flow"))
+        code.emit("flow", (threaded_flow(run_flow) if threaded else run_flow, d, d, flow_to))
+    elif flow_type == "write":
+        flow_to = node.flow_to
+        target = None
+        if flow_to.type == "property_access":
+            target = create_executor(compiler.compile(flow_to.target, "write flow"))
+        setter = create_write_setter(flow_to, compiler.address(flow_to), target)
+        code.emit("flow", (threaded_flow(run_write_flow) if threaded else run_write_flow, d, d, setter))
+    elif flow_type == "pop":
+        code.emit("flow", (pop_flow, d, d, None))
+    else:
+        raise Exception(f"unknown flow type {flow_type}")
+
+@bytecode_compiler.statement_lowerer("flow")
+def lower_flow_statement(compiler, node, code, d):
+    lower_flow(compiler, node, code, d, discarded=True)
+
+@bytecode_compiler.lowerer("function")
+def lower_function(compiler, node, code, d):
+    frame = compiler.frame(node)
+    if frame is not None:
+        size, argument_slots = frame
+        count = len(argument_slots)
+        body = compiler.compile(node.body, "function", size)
+        # with plain arguments, a call's registers are its arguments followed by these
+        filler = [unset] * (body.registers - count)
+        layout = (argument_slots, count if argument_slots == list(range(count)) else None, filler)
+    else:
+        layout = None
+        body = compiler.compile(node.body, "function")
+    code.emit("make_function", (d, body, layout, node.arguments))
+
+@bytecode_compiler.lowerer("index")
+def lower_index(compiler, node, code, d):
+    if is_pure(node.index):
+        target = operand(compiler, node.target, code, d)
+    else:
+        target = d
+        compiler.lower(node.target, code, d)
+    code.emit("index", (d, target, operand(compiler, node.index, code, d + 1)))
+
+@bytecode_compiler.lowerer("block")
+def lower_block(compiler, node, code, d):
+    compiler.lower_all(node.body, code, d)
+
+@bytecode_compiler.statement_lowerer("block")
+def lower_block_statement(compiler, node, code, d):
+    for statement in node.body:
+        compiler.lower_statement(statement, code, d)
+
+@bytecode_compiler.lowerer("int")
+@bytecode_compiler.lowerer("float")
+@bytecode_compiler.lowerer("string")
+@bytecode_compiler.lowerer("boolean")
+def lower_literal(compiler, node, code, d):
+    code.emit("const", (d, node.value))
+
+@bytecode_compiler.lowerer("list")
+def lower_list(compiler, node, code, d):
+    for i, value in enumerate(node.values):
+        compiler.lower(value, code, d + i)
+    code.emit("build_list", (d, d, len(node.values)))
+
+@bytecode_compiler.lowerer("tuple")
+def lower_tuple(compiler, node, code, d):
+    for i, value in enumerate(node.values):
+        compiler.lower(value, code, d + i)
+    code.emit("build_tuple", (d, d, len(node.values)))
+
+@bytecode_compiler.lowerer("negative")
+def lower_negative(compiler, node, code, d):
+    code.emit("negate", (d, operand(compiler, node.value, code, d)))
+
+@bytecode_compiler.lowerer("wrapped")
+def lower_wrapped(compiler, node, code, d):
+    compiler.lower(node.value, code, d)
+
+def lower_branches(compiler, code, d, branches, else_block, statement=False):
+    # shared by if and match, the first branch whose condition holds is taken
+    lower = compiler.lower_statement if statement else compiler.lower
+    ends = []
+    for condition, body in branches:
+        skip = lower_condition(compiler, condition, code, d)
+        lower(body, code, d)
+        ends.append(code.emit("jump"))
+        code.patch(skip)
+    if else_block is not None:
+        lower(else_block, code, d)
+    elif not statement:
+        code.emit("const", (d, None))
+    for end in ends:
+        code.patch(end)
+
+@bytecode_compiler.lowerer("if")
+def lower_if(compiler, node, code, d):
+    lower_branches(compiler, code, d, [node.if_clause] + node.elif_clauses, node.else_block)
+
+@bytecode_compiler.statement_lowerer("if")
+def lower_if_statement(compiler, node, code, d):
+    lower_branches(compiler, code, d, [node.if_clause] + node.elif_clauses, node.else_block, statement=True)
+
+@bytecode_compiler.lowerer("match")
+def lower_match(compiler, node, code, d):
+    lower_branches(compiler, code, d, [(case.condition, case.body) for case in node.cases], node.else_block)
+
+@bytecode_compiler.statement_lowerer("match")
+def lower_match_statement(compiler, node, code, d):
+    lower_branches(compiler, code, d, [(case.condition, case.body) for case in node.cases], node.else_block,
+                   statement=True)
+
+def lower_loop(compiler, node, code, iterator, statement):
+    # the check for the next value is at the bottom, so each time round only jumps once
+    compiler.lower(node.iterable, code, iterator)
+    code.emit("get_iter", (iterator, iterator))
+    enter = code.emit("jump")
+    body = len(code.instructions)
+    address = compiler.address(node)
+    if address is not None and address[0] == "slot" and address[1] == 0:
+        # the loop variable goes straight into its register
+        variable = address[2]
+    else:
+        variable = iterator + 1
+        emit_store(compiler, code, node, node.variable, variable)
+    if statement:
+        compiler.lower_statement(node.body, code, iterator + 1)
+    else:
+        # the value of a for is the value of its body the last time round
+        compiler.lower(node.body, code, iterator + 1)
+        code.emit("move", (iterator - 1, iterator + 1))
+    code.patch(enter)
+    code.emit("for_next", (body, iterator, variable))
+
+@bytecode_compiler.lowerer("for")
+def lower_for(compiler, node, code, d):
+    code.emit("const", (d, None))
+    lower_loop(compiler, node, code, d + 1, statement=False)
+
+@bytecode_compiler.statement_lowerer("for")
+def lower_for_statement(compiler, node, code, d):
+    lower_loop(compiler, node, code, d, statement=True)
+
+@bytecode_compiler.lowerer("break")
+def lower_break(compiler, node, code, d):
+    code.emit("break")
@@ -0,0 +1,73 @@
+class WindowView:
+    # size values of a list from start on. it's read-only and the list is never changed where it looks,
+    # so a view can be kept around, it prints and compares like a list of its values
+    __slots__ = ["values", "start", "size"]
+
+    def __init__(self, values, start, size):
+        self.values = values
+        self.start = start
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.values[self.start:self.start + self.size][index]
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("window index out of range")
+        return self.values[self.start + index]
+
+    def __iter__(self):
+        return iter(self.values[self.start:self.start + self.size])
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def __eq__(self, other):
+        if isinstance(other, (list, WindowView)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __add__(self, other):
+        if isinstance(other, (list, WindowView)):
+            return list(self) + list(other)
+        return NotImplemented
+
+    def __radd__(self, other):
+        if isinstance(other, (list, WindowView)):
+            return list(other) + list(self)
+        return NotImplemented
+
+    def __reduce__(self):
+        # just its own values, not the whole list it looks at
+        return WindowView, (list(self), 0, self.size)
+
+class WindowBuffer:
+    # the values of a stream for the windows of size over it. values are only ever appended to the list,
+    # views of it stay as they were, and once the values no window needs any more are as many as those
+    # kept, what's left is copied to a new list, so every value is copied about once
+    slack = 1024
+
+    def __init__(self, size):
+        self.size = size
+        self.values = []
+
+    def add(self, values):
+        # a view of each window that ends in one of values
+        first = len(self.values)
+        self.values.extend(values)
+        end = len(self.values)
+        views = [WindowView(self.values, stop - self.size, self.size)
+                 for stop in range(max(first + 1, self.size), end + 1)]
+        if end >= self.size + max(self.size, self.slack):
+            self.values = self.values[end - self.size + 1:]
+        return views
+
+    def missing(self):
+        # how many values there are to read before the first window
+        return max(self.size - 1 - len(self.values), 0)